@@ -13,6 +13,7 @@ from django.contrib.messages import constants as messages
 from pathlib import Path
 from decouple import config
 import os
+import sys
 
 MESSAGE_TAGS = {
     messages.DEBUG: 'alert-secondary',
@@ -96,9 +97,30 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # keep the connection opened by the warm-up for the first requests
+        'CONN_MAX_AGE': config('CONN_MAX_AGE', default=60, cast=int),
     }
 }
 
+# Spread the Vote and VoteBucket tables over this many SQLite files by
+# question (votes_0.sqlite3, ...), 0 to keep them in db.sqlite3. Create the
+# shards with `python manage.py migrate --database votes_N` for every N, then
+# move existing votes with `python manage.py rebalance_vote_shards`.
+POLLS_VOTE_SHARDS = config('POLLS_VOTE_SHARDS', default=0, cast=int)
+for shard in range(POLLS_VOTE_SHARDS):
+    DATABASES[f'votes_{shard}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'votes_{shard}.sqlite3',
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+    }
+DATABASE_ROUTERS = ['polls.routers.VoteShardRouter']
+
+# Applied to every new SQLite connection: WAL lets readers run during a vote.
+POLLS_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -140,3 +162,77 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Polls performance
+# Memory the in-memory voter index may take per worker (about 10 bytes per
+# voter), and cold lookups of a question before it is loaded.
+POLLS_VOTER_INDEX_BYTES = config('POLLS_VOTER_INDEX_BYTES', default=32 * 1024 * 1024, cast=int)
+POLLS_VOTER_INDEX_LOAD_AFTER = config('POLLS_VOTER_INDEX_LOAD_AFTER', default=20, cast=int)
+
+# mmap file shared by the workers of a host to count votes, empty to count
+# with the ORM. Run `python manage.py reconcile_tallies --interval 300` next to it.
+POLLS_TALLY_STORE = config('POLLS_TALLY_STORE', default='')
+POLLS_TALLY_CAPACITY = config('POLLS_TALLY_CAPACITY', default=65536, cast=int)
+
+# Polls closed for more than this many days are moved out of the Vote table
+# by `python manage.py archive_polls`.
+POLLS_ARCHIVE_AGE_DAYS = config('POLLS_ARCHIVE_AGE_DAYS', default=30, cast=int)
+
+# The admin vote list counts the whole table at most once per this many seconds.
+POLLS_ADMIN_COUNT_CACHE_TIMEOUT = config('POLLS_ADMIN_COUNT_CACHE_TIMEOUT', default=300, cast=int)
+
+# `python manage.py downsample_rollups` merges minute trend buckets older than
+# this many hours into hours, and hour buckets older than this many days into days.
+POLLS_ROLLUP_MINUTE_RETENTION_HOURS = config('POLLS_ROLLUP_MINUTE_RETENTION_HOURS', default=48, cast=int)
+POLLS_ROLLUP_HOUR_RETENTION_DAYS = config('POLLS_ROLLUP_HOUR_RETENTION_DAYS', default=30, cast=int)
+
+# Raise instead of logging a warning when a polls view goes over its query
+# budget or repeats the same query (see polls/querybudget.py).
+POLLS_QUERY_BUDGET_STRICT = config('POLLS_QUERY_BUDGET_STRICT', default=DEBUG, cast=bool)
+
+# Cache of the question and choices shown by the detail, results and vote
+# pages. The local memory cache is per process: with several workers use a
+# shared backend (memcached, redis) so an edit is seen everywhere at once.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+POLLS_DETAIL_CACHE_TIMEOUT = config('POLLS_DETAIL_CACHE_TIMEOUT', default=300, cast=int)
+
+# Most questions shown on a ballot when none are picked in the URL.
+POLLS_BALLOT_MAX_QUESTIONS = config('POLLS_BALLOT_MAX_QUESTIONS', default=50, cast=int)
+
+# Warm workers up (templates, URLs, connections, caches of the newest open
+# polls) in config/wsgi.py and config/asgi.py before they take traffic.
+POLLS_WARMUP = config('POLLS_WARMUP', default=True, cast=bool)
+POLLS_WARMUP_QUESTIONS = config('POLLS_WARMUP_QUESTIONS', default=20, cast=int)
+
+# Run the poll lifecycle scheduler in every worker: it refreshes the cached
+# pages when a poll opens or closes and freezes the results of closed polls.
+# With a shared cache, turn it off and run `python manage.py run_lifecycle`
+# once instead. Time-based caches never live longer than the max timeout, so
+# a poll created in another worker shows up on the home page within it; raise
+# it only with a cache shared by the workers.
+POLLS_LIFECYCLE = config('POLLS_LIFECYCLE', default=True, cast=bool)
+POLLS_LIFECYCLE_MAX_TIMEOUT = config('POLLS_LIFECYCLE_MAX_TIMEOUT', default=30, cast=int)
+
+# Log to userlogging.log, opened on the first message rather than at import.
+# Test runs log nowhere, their warnings are expected.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'file': {
+            'class': 'logging.FileHandler',
+            'filename': BASE_DIR / 'userlogging.log',
+            'delay': True,
+        } if sys.argv[1:2] != ['test'] else {
+            'class': 'logging.NullHandler',
+        },
+    },
+    'root': {
+        'handlers': ['file'],
+        'level': 'DEBUG',
+    },
+}
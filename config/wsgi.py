@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 
 import os
 
+from django.apps import apps
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
+
+# load templates, URLs, connections and caches before the first request
+apps.get_app_config('polls').warm_up()
+# open and close polls on time, see polls/lifecycle.py
+apps.get_app_config('polls').start_lifecycle()
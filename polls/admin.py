@@ -1,5 +1,264 @@
-from django.contrib import admin
+import csv
 
-from .models import Question
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import QueryDict, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
 
-admin.site.register(Question)
+from .models import ArchivedTally, Choice, Question, Vote, choice_vote_count
+from .lifecycle import refresh_closed_polls
+from .sharding import annotate_leaders, count_votes_by_choice, group_by_shard, shard_aliases, shard_count
+from .tallies import forget_final_tally, get_tally_store
+from .voter_index import voter_index
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that does not COUNT(*) a whole table on every page.
+
+    An unfiltered list is sized from the table statistics on PostgreSQL and
+    from a COUNT kept in the cache for POLLS_ADMIN_COUNT_CACHE_TIMEOUT
+    elsewhere, a filtered list is counted.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return super().count
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return int(row[0])
+            return super().count
+        key = f'polls:admin-count:{queryset.db}:{queryset.model._meta.db_table}'
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, getattr(settings, 'POLLS_ADMIN_COUNT_CACHE_TIMEOUT', 300))
+        return count
+
+
+class EchoWriter:
+    """File-like object that hands back what is written, for streaming CSV."""
+
+    def write(self, value):
+        return value
+
+
+class VoteCountChangeList(ChangeList):
+    """Changelist that lets its admin count votes of the page it shows."""
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.model_admin.count_page_votes(self.result_list)
+
+
+class VoteChangeList(ChangeList):
+    """Changelist whose links name the shard of each vote."""
+
+    def url_for_result(self, result):
+        url = super().url_for_result(result)
+        if shard_count():
+            url += '?' + urlencode({'shard': result._state.db})
+        return url
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    """Pick the vote shard to list, the first one by default."""
+
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()]
+
+    def queryset(self, request, queryset):
+        if self.value() in shard_aliases():
+            return queryset.using(self.value())
+        return queryset
+
+
+class ChoiceInline(admin.TabularInline):
+    model = Choice
+    extra = 1
+
+
+@admin.register(Question)
+class QuestionAdmin(admin.ModelAdmin):
+    """Questions with their vote total, counted in the list query."""
+
+    list_display = ('text', 'pub_date', 'end_date', 'archived_at', 'vote_count')
+    list_filter = ('pub_date', 'end_date')
+    search_fields = ('text',)
+    inlines = [ChoiceInline]
+    actions = ['close_polls', 'recount_votes', 'export_votes']
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if shard_count():
+            return queryset
+        return queryset.with_vote_count()
+
+    def get_changelist(self, request, **kwargs):
+        return VoteCountChangeList
+
+    def get_sortable_by(self, request):
+        if shard_count():
+            return [name for name in self.get_list_display(request) if name != 'vote_count']
+        return super().get_sortable_by(request)
+
+    def count_page_votes(self, questions):
+        """Count the votes of the page shard by shard, when they are sharded."""
+        if shard_count():
+            annotate_leaders(questions)
+
+    @admin.display(ordering='vote_count', description='votes')
+    def vote_count(self, question):
+        return question.vote_count
+
+    @admin.action(description="Close selected polls now")
+    def close_polls(self, request, queryset):
+        now = timezone.now()
+        queryset = queryset.exclude(end_date__lte=now)
+        question_ids = list(queryset.values_list('id', flat=True))
+        closed = Question.objects.filter(id__in=question_ids).update(end_date=now)
+        # update() sends no signal, run the close transition here
+        refresh_closed_polls(question_ids)
+        self.message_user(request, f"Closed {closed} poll(s).", messages.SUCCESS)
+
+    @admin.action(description="Recount votes of selected polls")
+    def recount_votes(self, request, queryset):
+        question_ids = list(queryset.values_list('id', flat=True))
+        for question_id in question_ids:
+            voter_index.discard(question_id)
+        forget_final_tally(*question_ids)
+        store = get_tally_store()
+        if store is not None:
+            store.reconcile()
+        self.message_user(request, f"Recounted {len(question_ids)} poll(s).", messages.SUCCESS)
+
+    @admin.action(description="Export votes of selected polls as CSV")
+    def export_votes(self, request, queryset):
+        question_ids = list(queryset.values_list('id', flat=True))
+        archived = (ArchivedTally.objects.filter(question__in=queryset.values('id')).order_by('question_id')
+                    .values_list('question_id', 'choice_id', 'votes'))
+        writer = csv.writer(EchoWriter())
+
+        def rows():
+            yield writer.writerow(['question_id', 'choice_id', 'user_id', 'votes'])
+            for alias, shard_question_ids in group_by_shard(sorted(question_ids)).items():
+                votes = (Vote.objects.using(alias).filter(question_id__in=shard_question_ids)
+                         .order_by('question_id', 'id').values_list('question_id', 'choice_id', 'user_id'))
+                for question_id, choice_id, user_id in votes.iterator(chunk_size=10000):
+                    yield writer.writerow([question_id, choice_id, user_id, 1])
+            for question_id, choice_id, count in archived.iterator():
+                yield writer.writerow([question_id, choice_id, '', count])
+
+        response = StreamingHttpResponse(rows(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="votes.csv"'
+        return response
+
+
+@admin.register(Choice)
+class ChoiceAdmin(admin.ModelAdmin):
+    """Choices with their vote count, counted in the list query."""
+
+    list_display = ('text', 'question', 'vote_count')
+    list_select_related = ('question',)
+    raw_id_fields = ('question',)
+    search_fields = ('text',)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if shard_count():
+            return queryset
+        return queryset.annotate(vote_count=choice_vote_count())
+
+    def get_changelist(self, request, **kwargs):
+        return VoteCountChangeList
+
+    def get_sortable_by(self, request):
+        if shard_count():
+            return [name for name in self.get_list_display(request) if name != 'vote_count']
+        return super().get_sortable_by(request)
+
+    def count_page_votes(self, choices):
+        """Count the votes of the page shard by shard, when they are sharded."""
+        if not shard_count():
+            return
+        live = {choice.question_id for choice in choices if choice.question.archived_at is None}
+        counts = count_votes_by_choice(live)
+        for choice in choices:
+            if choice.question_id in live:
+                choice.vote_count = counts.get(choice.id, 0)
+            else:
+                choice.vote_count = getattr(getattr(choice, 'archived_tally', None), 'votes', 0)
+
+    @admin.display(ordering='vote_count', description='votes')
+    def vote_count(self, choice):
+        return choice.vote_count
+
+
+@admin.register(Vote)
+class VoteAdmin(admin.ModelAdmin):
+    """
+    Votes, paginated without counting the whole table.
+
+    When votes are sharded the list shows one shard at a time and users,
+    questions and choices are prefetched from the default database.
+    """
+
+    list_display = ('id', 'user', 'question', 'choice')
+    list_select_related = ('user', 'question', 'choice')
+    raw_id_fields = ('user', 'question', 'choice')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_list_filter(self, request):
+        if shard_count():
+            return [ShardListFilter]
+        return super().get_list_filter(request)
+
+    def get_list_select_related(self, request):
+        if shard_count():
+            # the related tables are not in the shard, they are prefetched instead
+            return ()
+        return super().get_list_select_related(request)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if shard_count():
+            return queryset.using(shard_aliases()[0]).prefetch_related('user', 'question', 'choice')
+        return queryset
+
+    def get_changelist(self, request, **kwargs):
+        return VoteChangeList
+
+    def vote_shard(self, request):
+        """Return the shard named by ``?shard=`` or the changelist filters, if any."""
+        alias = request.GET.get('shard') or QueryDict(request.GET.get('_changelist_filters', '')).get('shard')
+        return alias if alias in shard_aliases() else None
+
+    def get_object(self, request, object_id, from_field=None):
+        """
+        Look for the vote in its shard. Every shard numbers its votes from 1,
+        so without a shard in the URL only an id found in a single shard is
+        returned.
+        """
+        if not shard_count():
+            return super().get_object(request, object_id, from_field)
+        queryset = super().get_queryset(request)
+        shard = self.vote_shard(request)
+        votes = [vote for alias in ([shard] if shard else shard_aliases())
+                 for vote in queryset.using(alias).filter(pk=object_id)[:1]]
+        return votes[0] if len(votes) == 1 else None
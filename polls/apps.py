@@ -6,3 +6,27 @@ class PollsConfig(AppConfig):
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls'
+
+    def ready(self):
+        """Connect the signal handlers."""
+        from . import signals, warmup  # noqa: F401
+
+    def warm_up(self, force=False):
+        """
+        Warm this worker up, called by the WSGI and ASGI entry points once
+        the application is loaded. Return the warm-up report.
+        """
+        from .warmup import warm_up
+        return warm_up(force)
+
+    def start_lifecycle(self):
+        """
+        Start the poll lifecycle scheduler in this worker when POLLS_LIFECYCLE
+        is set, called by the WSGI and ASGI entry points. Return the scheduler.
+        """
+        from django.conf import settings
+
+        from .lifecycle import scheduler
+        if getattr(settings, 'POLLS_LIFECYCLE', False):
+            scheduler.start()
+        return scheduler
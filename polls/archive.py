@@ -0,0 +1,79 @@
+"""Move the votes of long closed polls out of the Vote table."""
+import csv
+import datetime
+import gzip
+import logging
+import os
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import ArchivedTally, Question, Vote
+from .sharding import delete_rows, shard_for
+from .voter_index import voter_index
+
+logger = logging.getLogger("polls")
+
+
+def archivable_questions(age=None):
+    """Return the unarchived questions that ended more than ``age`` ago."""
+    if age is None:
+        age = datetime.timedelta(days=getattr(settings, 'POLLS_ARCHIVE_AGE_DAYS', 30))
+    return Question.objects.filter(archived_at__isnull=True, end_date__lt=timezone.now() - age)
+
+
+def export_votes(question, export_dir):
+    """Write the votes of a question to ``<export_dir>/question-<id>.csv.gz``."""
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, f'question-{question.id}.csv.gz')
+    rows = Vote.objects.filter(question=question).order_by('id').values_list('id', 'user_id', 'choice_id')
+    with gzip.open(path, 'wt', newline='') as export:
+        writer = csv.writer(export)
+        writer.writerow(['vote_id', 'user_id', 'choice_id'])
+        writer.writerows(rows.iterator(chunk_size=10000))
+    return path
+
+
+def delete_votes(question, alias):
+    """Delete the votes of a question with one statement, without signals."""
+    delete_rows(Vote, alias, 'question_id', question.id)
+
+
+def archive_question(question, export_dir=None):
+    """
+    Replace the votes of a question by one ArchivedTally row per choice.
+
+    The per-vote rows are exported first when ``export_dir`` is given. They
+    are then removed with a single DELETE, so the ``vote_changed`` signal is
+    not sent and the shared tally store keeps its counts. Votes kept in a
+    shard are deleted only once the archive is committed.
+    """
+    shard = shard_for(question.id)
+    with transaction.atomic():
+        question = Question.objects.select_for_update().get(pk=question.pk)
+        if question.archived_at is not None:
+            return question
+        if export_dir:
+            export_votes(question, export_dir)
+        counts = dict(Vote.objects.filter(question=question).values_list('choice_id')
+                      .annotate(votes=Count('id')).order_by())
+        ArchivedTally.objects.bulk_create(
+            ArchivedTally(question=question, choice_id=choice_id, votes=counts.get(choice_id, 0))
+            for choice_id in question.choice_set.values_list('id', flat=True)
+        )
+        question.archived_at = timezone.now()
+        question.save(update_fields=['archived_at'])
+        if shard == DEFAULT_DB_ALIAS:
+            delete_votes(question, shard)
+    if shard != DEFAULT_DB_ALIAS:
+        delete_votes(question, shard)
+    voter_index.discard(question.id)
+    logger.info("Archived question %s, %d votes", question.id, sum(counts.values()))
+    return question
+
+
+def archive_closed_polls(age=None, export_dir=None):
+    """Archive every question closed for longer than ``age``."""
+    return [archive_question(question, export_dir) for question in archivable_questions(age)]
@@ -0,0 +1,241 @@
+"""Act when polls open and close instead of checking the clock on every request."""
+import heapq
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import Min
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Question
+from .payloads import get_question_payload, invalidate_question_payload
+from .tallies import forget_final_tally, freeze_final_tallies
+from .voter_index import voter_index
+
+logger = logging.getLogger("polls")
+
+OPEN = 'open'
+CLOSE = 'close'
+INDEX_CACHE_KEY = 'polls:index'
+
+# Sent with question_id and kind (OPEN or CLOSE) once a poll has opened or
+# closed and the caches have been brought up to date.
+poll_transition = Signal()
+
+
+def cache_timeout(until, now):
+    """Return the seconds from ``now`` to ``until``, at most POLLS_LIFECYCLE_MAX_TIMEOUT."""
+    longest = getattr(settings, 'POLLS_LIFECYCLE_MAX_TIMEOUT', 30)
+    if until is None:
+        return longest
+    return max(1, min(longest, int((until - now).total_seconds()) + 1))
+
+
+def published_question_ids(limit=5):
+    """
+    Return the ids of the newest published questions.
+
+    The list only changes when a poll opens, so it is cached until the next
+    publication date, or until the scheduler or a question save drops it.
+    A save in another worker is not seen by a per-process cache, so the list
+    is never kept longer than POLLS_LIFECYCLE_MAX_TIMEOUT. Costs two queries
+    on a miss and none on a hit.
+    """
+    ids = cache.get(INDEX_CACHE_KEY)
+    if ids is not None:
+        return ids
+    now = timezone.now()
+    ids = list(Question.objects.filter(pub_date__lte=now).order_by('-pub_date').values_list('id', flat=True)[:limit])
+    next_open = Question.objects.filter(pub_date__gt=now).aggregate(next=Min('pub_date'))['next']
+    cache.set(INDEX_CACHE_KEY, ids, cache_timeout(next_open, now))
+    return ids
+
+
+def invalidate_published_questions():
+    """Drop the cached list of the home page."""
+    cache.delete(INDEX_CACHE_KEY)
+
+
+def open_poll(question_id):
+    """Rebuild the home page list and prime the pages of the opened poll."""
+    invalidate_published_questions()
+    invalidate_question_payload(question_id)
+    published_question_ids()
+    get_question_payload(question_id)
+    voter_index.warm(question_id)
+
+
+def refresh_closed_polls(question_ids):
+    """Drop the cached payloads of polls that just closed and freeze their results."""
+    invalidate_question_payload(*question_ids)
+    forget_final_tally(*question_ids)
+    freeze_final_tallies(question_ids)
+
+
+def close_poll(question_id):
+    """Bring the caches of a poll that just closed up to date and prime its payload."""
+    refresh_closed_polls([question_id])
+    get_question_payload(question_id)
+
+
+TRANSITIONS = {OPEN: open_poll, CLOSE: close_poll}
+
+
+def transitions(questions, now):
+    """Yield ``(when, kind, question_id)`` of the transitions after ``now``."""
+    for question_id, pub_date, end_date in questions:
+        if pub_date is not None and pub_date > now:
+            yield pub_date, OPEN, question_id
+        if end_date is not None and end_date > now:
+            yield end_date, CLOSE, question_id
+
+
+class LifecycleScheduler:
+    """
+    Heap of the upcoming poll transitions, fired by a timer thread.
+
+    :meth:`start` loads the transitions of every unarchived poll and runs
+    them in a daemon thread, :meth:`run_forever` does the same in the
+    calling thread for ``manage.py run_lifecycle``. Saved questions are
+    rescheduled through :meth:`schedule`, entries made stale by an edit are
+    skipped when they come up.
+
+    Property
+    --------
+    fired: int
+        Number of transitions run.
+    loaded: threading.Event
+        Set once the loop has loaded the transitions.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._dates = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.running = False
+        self.fired = 0
+        self.loaded = threading.Event()
+
+    def load(self, now=None):
+        """Schedule every future transition, return how many."""
+        now = now or timezone.now()
+        questions = list(Question.objects.filter(archived_at__isnull=True)
+                         .values_list('id', 'pub_date', 'end_date'))
+        with self._condition:
+            self._heap, self._dates = [], {}
+            for question_id, pub_date, end_date in questions:
+                self._dates[question_id] = (pub_date, end_date)
+            self._heap = list(transitions(questions, now))
+            heapq.heapify(self._heap)
+            self._condition.notify()
+            return len(self._heap)
+
+    def schedule(self, question, now=None):
+        """Schedule the transitions of a new or changed question."""
+        if not self.running:
+            return
+        now = now or timezone.now()
+        with self._condition:
+            self._dates[question.id] = (question.pub_date, question.end_date)
+            for entry in transitions([(question.id, question.pub_date, question.end_date)], now):
+                heapq.heappush(self._heap, entry)
+            self._condition.notify()
+
+    def unschedule(self, question_id):
+        """Forget a deleted question, its entries are skipped."""
+        with self._condition:
+            self._dates.pop(question_id, None)
+
+    def is_current(self, when, kind, question_id):
+        """Tell whether the entry still matches the dates of its question."""
+        pub_date, end_date = self._dates.get(question_id, (None, None))
+        return when == (pub_date if kind == OPEN else end_date)
+
+    def next_at(self):
+        """Return when the next transition is due, None when there is none."""
+        with self._condition:
+            return self._heap[0][0] if self._heap else None
+
+    def run_pending(self, now=None):
+        """Run the transitions due by ``now``, return ``[(kind, question_id)]``."""
+        now = now or timezone.now()
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                if self.is_current(*entry):
+                    due.append(entry[1:])
+        for kind, question_id in due:
+            try:
+                TRANSITIONS[kind](question_id)
+            except Exception:
+                logger.exception("Poll %s transition of question %s failed", kind, question_id)
+                continue
+            self.fired += 1
+            poll_transition.send(sender=Question, question_id=question_id, kind=kind)
+        return due
+
+    def wait_timeout(self, now):
+        """
+        Return how long to sleep before the next transition. The sleep never
+        goes past POLLS_LIFECYCLE_MAX_TIMEOUT: far dates (9999-12-31 for
+        "never") overflow the platform timer, and the heap is checked again
+        on waking anyway.
+        """
+        longest = getattr(settings, 'POLLS_LIFECYCLE_MAX_TIMEOUT', 30)
+        next_at = self._heap[0][0] if self._heap else None
+        if next_at is None:
+            return longest
+        return max(0, min(longest, (next_at - now).total_seconds()))
+
+    def run_forever(self):
+        """Load the transitions and run each one when it is due, until stopped."""
+        self.running = True
+        self.loaded.clear()
+        while True:
+            with self._condition:
+                if self._stopping:
+                    break
+                if self.loaded.is_set():
+                    self._condition.wait(self.wait_timeout(timezone.now()))
+                    if self._stopping:
+                        break
+            close_old_connections()
+            # one bad row must not kill the thread, the next wake-up tries again
+            try:
+                if not self.loaded.is_set():
+                    self.load()
+                    self.loaded.set()
+                self.run_pending()
+            except Exception:
+                logger.exception("Poll lifecycle scheduler failed")
+                if not self.loaded.is_set():
+                    with self._condition:
+                        self._condition.wait(getattr(settings, 'POLLS_LIFECYCLE_MAX_TIMEOUT', 30))
+        self.running = False
+
+    def start(self):
+        """Run :meth:`run_forever` in a daemon thread, once per process."""
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self.running, self._stopping = True, False
+        self._thread = threading.Thread(target=self.run_forever, name='polls-lifecycle', daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Stop the loop and wait for the thread."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+scheduler = LifecycleScheduler()
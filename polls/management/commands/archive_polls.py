@@ -0,0 +1,24 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from polls.archive import archive_closed_polls
+
+
+class Command(BaseCommand):
+    """Archive the votes of polls closed for a long time."""
+
+    help = "Move the votes of polls closed longer than --age-days into ArchivedTally."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--age-days', type=float, default=None,
+                            help="Archive polls closed for more than this many days (POLLS_ARCHIVE_AGE_DAYS).")
+        parser.add_argument('--export-dir', default=None,
+                            help="Also write the votes of each poll to a gzipped CSV file in this directory.")
+
+    def handle(self, *args, **options):
+        age = None
+        if options['age_days'] is not None:
+            age = datetime.timedelta(days=options['age_days'])
+        archived = archive_closed_polls(age, options['export_dir'])
+        self.stdout.write(f"Archived {len(archived)} poll(s)")
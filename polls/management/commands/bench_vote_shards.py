@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SCHEMA = ('CREATE TABLE IF NOT EXISTS vote (id INTEGER PRIMARY KEY, user_id INTEGER, question_id INTEGER, '
+          'choice_id INTEGER, voted_at REAL, UNIQUE (user_id, question_id))')
+
+
+def cast_votes(directory, shards, questions, votes, seed):
+    """Cast ``votes`` votes on random questions, one transaction each, like vote() does."""
+    connections = []
+    for shard in range(shards):
+        connection = sqlite3.connect(os.path.join(directory, f'votes_{shard}.sqlite3'), timeout=60,
+                                     isolation_level=None)
+        for name, value in getattr(settings, 'POLLS_SQLITE_PRAGMAS', {}).items():
+            connection.execute(f'PRAGMA {name} = {value}')
+        connections.append(connection)
+    generator = random.Random(seed)
+    waited = 0.0
+    for vote in range(votes):
+        question_id = generator.randrange(questions)
+        connection = connections[question_id % shards]
+        start = time.perf_counter()
+        connection.execute('BEGIN IMMEDIATE')
+        waited += time.perf_counter() - start
+        connection.execute('INSERT OR REPLACE INTO vote (user_id, question_id, choice_id, voted_at) '
+                           'VALUES (?, ?, ?, ?)', (seed * votes + vote, question_id, question_id * 4, time.time()))
+        connection.execute('COMMIT')
+    for connection in connections:
+        connection.close()
+    return waited
+
+
+class Command(BaseCommand):
+    """Measure vote throughput against the number of shards."""
+
+    help = ("Cast votes from several processes into 1, 2, 4 and 8 SQLite shards in a temporary "
+            "directory and report the votes per second and the time spent waiting for a write lock.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent voting processes.")
+        parser.add_argument('--votes', type=int, default=500, help="Votes cast by every worker.")
+        parser.add_argument('--questions', type=int, default=64, help="Polls the votes are spread over.")
+
+    def run(self, shards, options):
+        """Return (seconds, total lock wait in seconds) of one run."""
+        with tempfile.TemporaryDirectory() as directory:
+            for shard in range(shards):
+                with sqlite3.connect(os.path.join(directory, f'votes_{shard}.sqlite3')) as connection:
+                    connection.execute('PRAGMA journal_mode = wal')
+                    connection.execute(SCHEMA)
+            jobs = [(directory, shards, options['questions'], options['votes'], seed)
+                    for seed in range(options['workers'])]
+            with multiprocessing.Pool(options['workers']) as pool:
+                start = time.perf_counter()
+                waits = pool.starmap(cast_votes, jobs)
+                return time.perf_counter() - start, sum(waits)
+
+    def handle(self, *args, **options):
+        total = options['workers'] * options['votes']
+        self.stdout.write(f"{total} votes from {options['workers']} processes over {options['questions']} polls")
+        self.stdout.write(f"{'shards':>8}{'seconds':>10}{'votes/s':>10}{'lock wait':>12}")
+        for shards in options['shards']:
+            seconds, waited = self.run(shards, options)
+            self.stdout.write(f"{shards:>8}{seconds:>10.2f}{total / seconds:>10.0f}"
+                              f"{waited / options['workers']:>11.2f}s")
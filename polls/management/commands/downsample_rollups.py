@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from polls.rollups import downsample_all
+
+
+class Command(BaseCommand):
+    """Merge old trend buckets into coarser ones."""
+
+    help = "Merge old minute trend buckets into hours and old hour buckets into days."
+
+    def handle(self, *args, **options):
+        removed = downsample_all()
+        self.stdout.write(f"Merged {removed} bucket(s)")
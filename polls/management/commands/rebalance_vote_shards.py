@@ -0,0 +1,147 @@
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from polls.models import Vote, VoteBucket
+from polls.rollups import add_to_bucket
+from polls.sharding import shard_for
+from polls.tallies import get_tally_store
+from polls.voter_index import voter_index
+
+
+class Command(BaseCommand):
+    """
+    Move votes and trend buckets to the shard of their question.
+
+    Rows are copied without their id, the shard assigns a new one, and are
+    then deleted from their old database without sending vote signals.
+    Buckets are added to the ones the target already has. A user with a
+    vote on both sides keeps the most recently cast one, and the tallies of
+    those polls are then rebuilt. An interrupted run leaves the last batch
+    on both sides: its votes are merged again on the next run, its buckets
+    are counted twice.
+
+    Shards dropped by lowering POLLS_VOTE_SHARDS are no longer in DATABASES:
+    their ``votes_N.sqlite3`` files are found in ``--shard-dir`` and opened
+    for the run.
+    """
+
+    help = ("Move every vote and trend bucket found in the default database or in a vote shard "
+            "to the shard POLLS_VOTE_SHARDS assigns to its question. Run it after changing the "
+            "number of shards, once every shard has been migrated.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows moved per transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows to move.")
+        parser.add_argument('--shard-dir', default=settings.BASE_DIR,
+                            help="Where to look for the files of shards no longer configured.")
+
+    def dropped_shards(self, shard_dir):
+        """Open the shard files that have no alias and return their temporary aliases."""
+        aliases = []
+        for path in sorted(Path(shard_dir).glob('votes_*.sqlite3')):
+            alias = path.name[:-len('.sqlite3')]
+            if re.fullmatch(r'votes_\d+', alias) and alias not in connections.databases:
+                connections.databases[alias] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+                aliases.append(alias)
+        return aliases
+
+    def sources(self, dropped):
+        """Return the aliases that may hold misplaced rows."""
+        shards = {alias for alias in settings.DATABASES if alias.startswith('votes_')}
+        return [DEFAULT_DB_ALIAS] + sorted(shards | set(dropped))
+
+    def delete(self, model, source, ids):
+        """Delete rows with a plain DELETE: they only move, the tallies must not see them go."""
+        with transaction.atomic(using=source), connections[source].cursor() as cursor:
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE id IN ({placeholders})', ids)
+
+    def copy_votes(self, target, question_id, batch):
+        """
+        Insert the votes into the target shard. A user who already has a vote
+        for the question there keeps the most recently cast one. Return the
+        number of votes dropped that way.
+        """
+        existing = {vote.user_id: vote for vote in Vote.objects.using(target).filter(
+            question_id=question_id, user_id__in=[vote.user_id for vote in batch])}
+        created, updated = [], []
+        for vote in batch:
+            kept = existing.get(vote.user_id)
+            if kept is None:
+                vote.pk = None
+                created.append(vote)
+            elif vote.voted_at > kept.voted_at:
+                kept.choice_id, kept.voted_at = vote.choice_id, vote.voted_at
+                updated.append(kept)
+        with transaction.atomic(using=target):
+            Vote.objects.using(target).bulk_update(updated, ['choice', 'voted_at'])
+            Vote.objects.using(target).bulk_create(created)
+        return len(batch) - len(created)
+
+    def copy_buckets(self, target, question_id, batch):
+        """Add the buckets to the ones of the target shard, merging those that exist."""
+        with transaction.atomic(using=target):
+            for bucket in batch:
+                add_to_bucket(bucket.question_id, bucket.choice_id, bucket.resolution, bucket.start, bucket.votes)
+        return 0
+
+    def move(self, model, source, batch_size, dry_run):
+        """
+        Move the misplaced rows of ``model`` out of ``source``. Return how many
+        were moved and the questions whose votes clashed with the target's.
+        """
+        moved, clashed = 0, set()
+        copy = self.copy_votes if model is Vote else self.copy_buckets
+        question_ids = (model.objects.using(source).order_by('question_id')
+                        .values_list('question_id', flat=True).distinct())
+        for question_id in list(question_ids):
+            target = shard_for(question_id)
+            if target == source:
+                continue
+            rows = model.objects.using(source).filter(question_id=question_id)
+            if dry_run:
+                moved += rows.count()
+                continue
+            while True:
+                batch = list(rows.order_by('id')[:batch_size])
+                if not batch:
+                    break
+                ids = [row.id for row in batch]
+                # written before deleted, an interruption leaves a copy rather than a loss
+                if copy(target, question_id, batch):
+                    clashed.add(question_id)
+                self.delete(model, source, ids)
+                moved += len(batch)
+        return moved, clashed
+
+    def handle(self, *args, **options):
+        clashed = set()
+        dropped = self.dropped_shards(options['shard_dir'])
+        try:
+            for model in (Vote, VoteBucket):
+                for source in self.sources(dropped):
+                    moved, model_clashed = self.move(model, source, options['batch_size'], options['dry_run'])
+                    if moved:
+                        verb = "Would move" if options['dry_run'] else "Moved"
+                        self.stdout.write(f"{verb} {moved} {model._meta.verbose_name_plural} out of {source}")
+                    clashed |= model_clashed
+        finally:
+            for alias in dropped:
+                connections[alias].close()
+                del connections[alias]
+                del connections.databases[alias]
+        if dropped and not options['dry_run']:
+            self.stdout.write(f"Emptied the dropped shards {', '.join(dropped)}, their files can be deleted")
+        if clashed:
+            # a dropped duplicate had been counted, and may be cached by the workers
+            for question_id in clashed:
+                voter_index.discard(question_id)
+            store = get_tally_store()
+            if store is not None:
+                store.reconcile()
+            self.stdout.write(f"Kept the latest vote of users who had voted twice on {len(clashed)} poll(s)")
+        self.stdout.write("Done")
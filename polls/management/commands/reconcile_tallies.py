@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.tallies import get_tally_store
+
+
+class Command(BaseCommand):
+    """Rebuild the shared tally store from the Vote table."""
+
+    help = "Reconcile the shared tally store with the Vote table, once or every --interval seconds."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Keep running and reconcile every INTERVAL seconds.")
+
+    def handle(self, *args, **options):
+        store = get_tally_store()
+        if store is None:
+            raise CommandError("The tally store is disabled, set POLLS_TALLY_STORE to a file path.")
+        while True:
+            store.reconcile()
+            self.stdout.write(f"Reconciled {store.path}")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from polls.lifecycle import poll_transition, scheduler
+
+
+class Command(BaseCommand):
+    """Open and close polls on time outside of the web workers."""
+
+    help = ("Fire the open and close transitions of every poll when they are due: refresh the "
+            "cached pages, freeze the results of closed polls and prime the pages of opened ones. "
+            "Use it with a cache shared by the workers and POLLS_LIFECYCLE off.")
+
+    def report(self, sender, question_id, kind, **kwargs):
+        self.stdout.write(f"Question {question_id}: {kind}")
+
+    def handle(self, *args, **options):
+        poll_transition.connect(self.report)
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            poll_transition.disconnect(self.report)
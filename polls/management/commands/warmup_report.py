@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+from polls.models import Question
+from polls.warmup import warm_up
+
+
+class Command(BaseCommand):
+    """Compare a cold worker with a warmed-up one."""
+
+    help = "Start a cold and a warmed-up worker process and report their startup time and first-request latency."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--child', choices=['cold', 'warm'], help="Measure this process (used internally).")
+
+    def measure(self, mode):
+        """Return the timings of this process, started at POLLS_STARTED_AT."""
+        started_at = float(os.environ.get('POLLS_STARTED_AT', time.time()))
+        report = {'startup': time.time() - started_at, 'warmup': 0.0, 'requests': {}}
+        if mode == 'warm':
+            start = time.perf_counter()
+            warm_up(force=True)
+            report['warmup'] = time.perf_counter() - start
+        urls = [reverse('polls:polls-home'), reverse('polls:signup')]
+        question = Question.objects.order_by('-pub_date').first()
+        if question is not None:
+            urls += [reverse('polls:polls-detail', args=[question.id]),
+                     reverse('polls:polls-results', args=[question.id])]
+        client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost')
+        for url in urls:
+            timings = []
+            for _ in range(2):
+                start = time.perf_counter()
+                client.get(url)
+                timings.append(time.perf_counter() - start)
+            report['requests'][url] = timings
+        return report
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self.measure(options['child'])))
+            return
+        reports = {}
+        for mode in ('cold', 'warm'):
+            env = dict(os.environ, POLLS_STARTED_AT=str(time.time()), POLLS_WARMUP='False')
+            output = subprocess.run([sys.executable, sys.argv[0], 'warmup_report', '--child', mode],
+                                    env=env, check=True, capture_output=True, text=True).stdout
+            reports[mode] = json.loads(output.strip().splitlines()[-1])
+        self.stdout.write(f"{'':32}{'cold':>12}{'warm':>12}")
+        for key in ('startup', 'warmup'):
+            self.stdout.write(f"{key:32}{reports['cold'][key] * 1000:>10.1f}ms{reports['warm'][key] * 1000:>10.1f}ms")
+        for url, cold in reports['cold']['requests'].items():
+            warm = reports['warm']['requests'][url]
+            self.stdout.write(f"{'first ' + url:32}{cold[0] * 1000:>10.1f}ms{warm[0] * 1000:>10.1f}ms")
+            self.stdout.write(f"{'second ' + url:32}{cold[1] * 1000:>10.1f}ms{warm[1] * 1000:>10.1f}ms")
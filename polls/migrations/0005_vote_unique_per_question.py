@@ -0,0 +1,29 @@
+# Generated by Django 3.2.6 on 2026-10-19 19:42
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    """Keep only the latest vote of a user on each question."""
+    Vote = apps.get_model('polls', 'Vote')
+    duplicates = (Vote.objects.values('question_id', 'user_id')
+                  .annotate(n=Count('id'), last_id=Max('id')).filter(n__gt=1))
+    for row in duplicates:
+        (Vote.objects.filter(question_id=row['question_id'], user_id=row['user_id'])
+         .exclude(id=row['last_id']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_auto_20211027_1230'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('question', 'user'), name='unique_vote_per_question'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.6 on 2026-10-19 19:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Count
+
+
+def backfill_buckets(apps, schema_editor):
+    """Put the votes cast before rollups existed in one daily bucket."""
+    Vote = apps.get_model('polls', 'Vote')
+    VoteBucket = apps.get_model('polls', 'VoteBucket')
+    start = django.utils.timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = Vote.objects.values_list('question_id', 'choice_id').annotate(votes=Count('id')).order_by()
+    VoteBucket.objects.bulk_create(
+        VoteBucket(question_id=question_id, choice_id=choice_id, resolution=24 * 60 * 60, start=start, votes=votes)
+        for question_id, choice_id, votes in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_archived_tally'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='voted_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='VoteBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField(choices=[(60, 'minute'), (3600, 'hour'), (86400, 'day')], default=60)),
+                ('start', models.DateTimeField()),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='votebucket',
+            index=models.Index(fields=['question', 'start'], name='polls_voteb_questio_c04050_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='votebucket',
+            constraint=models.UniqueConstraint(fields=('choice', 'resolution', 'start'), name='unique_vote_bucket'),
+        ),
+        migrations.RunPython(backfill_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.6 on 2026-10-19 19:55
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polls', '0007_vote_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vote',
+            name='choice',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='polls.choice'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='votebucket',
+            name='choice',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='polls.choice'),
+        ),
+        migrations.AlterField(
+            model_name='votebucket',
+            name='question',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+    ]
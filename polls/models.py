@@ -1,7 +1,45 @@
 from django.db import models
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 import datetime
 from django.utils import timezone
 from django.contrib.auth.models import User
+from .sharding import ShardedQuerySet
+
+
+class QuestionQuerySet(models.QuerySet):
+    """Questions annotated with their votes as correlated subqueries."""
+
+    def with_vote_count(self):
+        """Annotate ``vote_count``, read from ArchivedTally for archived polls."""
+        votes = (Vote.objects.filter(question=OuterRef('pk')).order_by()
+                 .values('question').annotate(n=Count('id')).values('n'))
+        archived = (ArchivedTally.objects.filter(question=OuterRef('pk')).order_by()
+                    .values('question').annotate(n=Sum('votes')).values('n'))
+        return self.annotate(vote_count=Coalesce(Subquery(votes), Subquery(archived), 0, output_field=IntegerField()))
+
+    def with_leader(self):
+        """
+        Annotate ``vote_count`` and the leading choice, ``leader_text`` and
+        ``leader_votes``, still in a single query. Ties go to the oldest choice.
+        """
+        leaders = (Choice.objects.filter(question=OuterRef('pk')).annotate(vote_count=choice_vote_count())
+                   .order_by('-vote_count', 'id'))
+        return self.with_vote_count().annotate(
+            leader_text=Subquery(leaders.values('text')[:1]),
+            leader_votes=Subquery(leaders.values('vote_count')[:1]),
+        )
+
+
+def choice_vote_count():
+    """
+    Return an expression counting the votes of the outer choice, read from
+    ArchivedTally for archived polls.
+    """
+    votes = (Vote.objects.filter(choice=OuterRef('pk')).order_by()
+             .values('choice').annotate(n=Count('id')).values('n'))
+    return Coalesce(Subquery(votes), F('archived_tally__votes'), 0, output_field=IntegerField())
+
 
 class Question(models.Model):
     """
@@ -14,15 +52,24 @@ class Question(models.Model):
 
     pub_date: datetime
         Time that the question has been created.
+
+    archived_at: datetime
+        Time that the votes were moved to :model:`polls.ArchivedTally`,
+        None while they are still in :model:`polls.Vote`.
     """
 
     text = models.CharField(max_length=200)
     pub_date = models.DateTimeField(default=timezone.now)
     end_date = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = QuestionQuerySet.as_manager()
 
     def can_vote(self):
         """Check that poll is ended."""
         now = timezone.now()
+        if self.archived_at is not None:
+            return False
         if self.end_date is None:
             return True
         return self.end_date >= now
@@ -65,12 +112,102 @@ class Choice(models.Model):
 
     @property
     def votes(self):
+        if self.question.archived_at is not None:
+            try:
+                return self.archived_tally.votes
+            except ArchivedTally.DoesNotExist:
+                return 0
         return self.question.vote_set.filter(choice=self).count()
     
     def __str__(self):
         return self.text
 
 class Vote(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    """
+    Store the choice a user voted for, one per user per question.
+
+    Property
+    --------
+    user: User
+        User who voted.
+    question: Question
+        Question that the vote is for.
+    choice: Choice
+        Choice that the user selected.
+    voted_at: datetime
+        Time that the vote was cast or last changed.
+    """
+
+    # no database constraints, the votes may live in a shard of their own;
+    # deletes do not cascade, polls/signals.py removes them in one statement
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False)
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    choice = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False)
+    voted_at = models.DateTimeField(default=timezone.now)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['question', 'user'], name='unique_vote_per_question'),
+        ]
+
+
+class ArchivedTally(models.Model):
+    """
+    Store the final number of votes of a choice once its poll is archived.
+
+    Property
+    --------
+    question: Question
+        Archived question.
+    choice: Choice
+        Choice that the votes were for.
+    votes: int
+        Number of votes the choice had when it was archived.
+    """
+
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
-    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
\ No newline at end of file
+    choice = models.OneToOneField(Choice, on_delete=models.CASCADE, related_name='archived_tally')
+    votes = models.PositiveIntegerField(default=0)
+
+
+class VoteBucket(models.Model):
+    """
+    Store the net change of a choice's votes during one time bucket.
+
+    Property
+    --------
+    question: Question
+        Question of the choice.
+    choice: Choice
+        Choice whose votes changed.
+    resolution: int
+        Length of the bucket in seconds, a minute, an hour or a day.
+    start: datetime
+        Start of the bucket.
+    votes: int
+        Votes gained minus votes lost during the bucket.
+    """
+
+    MINUTE = 60
+    HOUR = 60 * 60
+    DAY = 24 * 60 * 60
+    RESOLUTIONS = [(MINUTE, 'minute'), (HOUR, 'hour'), (DAY, 'day')]
+
+    # deleted with their question or choice by polls/signals.py, in their shard
+    question = models.ForeignKey(Question, on_delete=models.DO_NOTHING, db_constraint=False)
+    choice = models.ForeignKey(Choice, on_delete=models.DO_NOTHING, db_constraint=False)
+    resolution = models.PositiveIntegerField(choices=RESOLUTIONS, default=MINUTE)
+    start = models.DateTimeField()
+    votes = models.IntegerField(default=0)
+
+    objects = ShardedQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'resolution', 'start'], name='unique_vote_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['question', 'start']),
+        ]
@@ -0,0 +1,40 @@
+"""Cached question and choices shared by the detail, results and vote views."""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Choice, Question
+
+
+def detail_cache_key(question_id):
+    return f'polls:detail:{question_id}'
+
+
+def get_question_payload(question_id):
+    """
+    Return ``(question, choices)`` with the choices ordered by id, or None.
+
+    A cache miss loads the choices and their question in one query, plus one
+    for a question without choices. The payload is dropped by the signals
+    whenever the question or one of its choices is saved or deleted.
+    """
+    key = detail_cache_key(question_id)
+    payload = cache.get(key)
+    if payload is not None:
+        return payload
+    choices = list(Choice.objects.filter(question_id=question_id).select_related('question').order_by('id'))
+    if choices:
+        question = choices[0].question
+        for choice in choices:
+            choice.question = question
+    else:
+        question = Question.objects.filter(pk=question_id).first()
+        if question is None:
+            return None
+    payload = (question, choices)
+    cache.set(key, payload, getattr(settings, 'POLLS_DETAIL_CACHE_TIMEOUT', 300))
+    return payload
+
+
+def invalidate_question_payload(*question_ids):
+    """Drop the cached payload of the given questions."""
+    cache.delete_many([detail_cache_key(question_id) for question_id in question_ids])
@@ -0,0 +1,153 @@
+"""Count the queries of a view and complain when it goes over its budget."""
+import functools
+import logging
+import re
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.urls import resolve
+
+from .sharding import shard_count
+
+logger = logging.getLogger("polls")
+
+# values that change between two runs of the same query
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+PLACEHOLDER_LISTS = re.compile(r"\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in strict mode when a view runs more queries than its budget."""
+
+
+def query_shape(sql):
+    """Return ``sql`` with its literals and ``IN`` lists replaced by ``?``."""
+    return PLACEHOLDER_LISTS.sub('(?)', LITERALS.sub('?', sql))
+
+
+class QueryBudget:
+    """
+    Record the queries run on every database inside a ``with`` block.
+
+    Usable as a context manager or, through :func:`query_budget`, as a view
+    decorator. On exit the queries are compared with ``budget`` and searched
+    for N+1 signatures, the same query shape run ``repeat_limit`` times or
+    more on one database: running it once per vote shard is not one. A
+    problem raises :class:`QueryBudgetExceeded` when ``strict`` (by default
+    ``POLLS_QUERY_BUDGET_STRICT``) and is logged as a warning otherwise.
+
+    Property
+    --------
+    budget: int
+        Number of queries allowed, None to only look for N+1.
+    queries: list
+        SQL of every query recorded.
+    databases: list
+        Alias of the database each query ran on.
+    """
+
+    def __init__(self, budget=None, name='block', repeat_limit=3, strict=None):
+        self.budget = budget
+        self.name = name
+        self.repeat_limit = repeat_limit
+        self.strict = strict
+        self.queries = []
+        self.databases = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        self.databases.append(context['connection'].alias)
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.queries, self.databases = [], []
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stack.close()
+        if exc_type is None:
+            self.check()
+
+    def repeated(self):
+        """Return ``{shape: times}`` of the shapes run at least repeat_limit times on one database."""
+        counts = Counter(zip(self.databases, map(query_shape, self.queries)))
+        repeated = {}
+        for (_, shape), times in counts.items():
+            if times >= self.repeat_limit:
+                repeated[shape] = max(times, repeated.get(shape, 0))
+        return repeated
+
+    def problems(self):
+        """Return a description of every way the block broke its budget."""
+        problems = []
+        if self.budget is not None and len(self.queries) > self.budget:
+            problems.append(f"{self.name} ran {len(self.queries)} queries, budget is {self.budget}")
+        for shape, times in self.repeated().items():
+            problems.append(f"{self.name} ran the same query {times} times (N+1?): {shape}")
+        return problems
+
+    def check(self):
+        problems = self.problems()
+        if not problems:
+            return
+        strict = self.strict
+        if strict is None:
+            strict = getattr(settings, 'POLLS_QUERY_BUDGET_STRICT', False)
+        if strict:
+            raise QueryBudgetExceeded("\n".join(problems))
+        for problem in problems:
+            logger.warning(problem)
+
+
+def sharded_budget(budget, sharded=None, per_shard=0):
+    """
+    Return the budget of a view for the current POLLS_VOTE_SHARDS: ``budget``
+    without shards, else ``sharded`` (default ``budget``) plus ``per_shard``
+    queries for every shard.
+    """
+    shards = shard_count()
+    if not shards:
+        return budget
+    return (budget if sharded is None else sharded) + per_shard * shards
+
+
+def query_budget(budget, repeat_limit=3, sharded=None, per_shard=0):
+    """
+    Decorate a view with a :class:`QueryBudget`.
+
+    Template responses are rendered inside the budget so the queries run by
+    the template count too. Views that query every vote shard give their
+    cost with shards through ``sharded`` and ``per_shard``, see
+    :func:`sharded_budget`. The budget is kept on the view as
+    ``view.query_budget`` for :class:`QueryBudgetTestMixin`.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            allowed = wrapper.query_budget()
+            with QueryBudget(allowed, name=request.path, repeat_limit=repeat_limit):
+                response = view(request, *args, **kwargs)
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+            return response
+        wrapper.query_budget = functools.partial(sharded_budget, budget, sharded, per_shard)
+        return wrapper
+    return decorator
+
+
+class QueryBudgetTestMixin:
+    """TestCase mixin that checks a whole request against the view's budget."""
+
+    def assertQueryBudget(self, url, method='get', data=None, budget=None, **extra):
+        """Request ``url`` and fail on going over budget or on N+1 queries."""
+        if budget is None:
+            budget = resolve(url).func.query_budget()
+        with QueryBudget(budget, name=url, strict=True) as recorder:
+            response = getattr(self.client, method)(url, data, **extra)
+        return response, recorder
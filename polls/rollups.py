@@ -0,0 +1,138 @@
+"""Per-choice vote counts bucketed by time, for trend charts."""
+import datetime
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import VoteBucket
+from .sharding import group_by_shard, shard_aliases, shard_for
+
+logger = logging.getLogger("polls")
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def bucket_start(when, resolution):
+    """Return the start of the ``resolution`` seconds bucket holding ``when``."""
+    seconds = int((when - EPOCH).total_seconds())
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % resolution)
+
+
+def add_to_bucket(question_id, choice_id, resolution, start, votes):
+    """Add ``votes`` to a bucket, creating it if it does not exist yet."""
+    bucket = VoteBucket.objects.filter(question_id=question_id, choice_id=choice_id, resolution=resolution, start=start)
+    if bucket.update(votes=F('votes') + votes):
+        return
+    try:
+        with transaction.atomic(using=shard_for(question_id)):
+            VoteBucket.objects.create(question_id=question_id, choice_id=choice_id,
+                                      resolution=resolution, start=start, votes=votes)
+    except IntegrityError:
+        # created by a concurrent vote
+        bucket.update(votes=F('votes') + votes)
+
+
+def record_votes(changes, when=None):
+    """
+    Count ``(question_id, old_choice_id, new_choice_id)`` vote moves in the
+    current minute bucket, with one read and at most one update and one
+    insert whatever the number of choices.
+    """
+    start = bucket_start(when or timezone.now(), VoteBucket.MINUTE)
+    deltas = defaultdict(int)
+    questions = {}
+    for question_id, old_choice_id, new_choice_id in changes:
+        for choice_id, delta in ((old_choice_id, -1), (new_choice_id, 1)):
+            if choice_id is not None:
+                deltas[choice_id] += delta
+                questions[choice_id] = question_id
+    deltas = {choice_id: delta for choice_id, delta in deltas.items() if delta}
+    for alias, choice_ids in group_by_shard(deltas, questions.get).items():
+        record_shard_votes(alias, {choice_id: deltas[choice_id] for choice_id in choice_ids}, questions, start)
+
+
+def record_shard_votes(alias, deltas, questions, start):
+    """Add ``{choice_id: delta}`` to the minute buckets of one vote shard."""
+    existing = VoteBucket.objects.using(alias).filter(resolution=VoteBucket.MINUTE, start=start, choice_id__in=deltas)
+    buckets = list(existing.only('id', 'question_id', 'choice_id'))
+    for bucket in buckets:
+        bucket.votes = F('votes') + deltas.pop(bucket.choice_id)
+    VoteBucket.objects.using(alias).bulk_update(buckets, ['votes'])
+    try:
+        with transaction.atomic(using=alias):
+            VoteBucket.objects.using(alias).bulk_create(
+                VoteBucket(question_id=questions[choice_id], choice_id=choice_id,
+                           resolution=VoteBucket.MINUTE, start=start, votes=delta)
+                for choice_id, delta in deltas.items()
+            )
+    except IntegrityError:
+        # some were created by a concurrent vote
+        for choice_id, delta in deltas.items():
+            add_to_bucket(questions[choice_id], choice_id, VoteBucket.MINUTE, start, delta)
+
+
+def record_vote(question_id, old_choice_id, new_choice_id, when=None):
+    """Move one vote between choices in the current minute bucket."""
+    record_votes([(question_id, old_choice_id, new_choice_id)], when)
+
+
+def downsample(resolution, to_resolution, older_than):
+    """
+    Merge the ``resolution`` buckets older than ``older_than`` into
+    ``to_resolution`` buckets. Return the number of buckets removed.
+    """
+    removed = 0
+    for alias in shard_aliases():
+        old = VoteBucket.objects.using(alias).filter(resolution=resolution, start__lt=timezone.now() - older_than)
+        with transaction.atomic(using=alias):
+            merged = defaultdict(int)
+            ids = []
+            for bucket_id, question_id, choice_id, start, votes in old.values_list(
+                    'id', 'question_id', 'choice_id', 'start', 'votes').iterator(chunk_size=10000):
+                merged[question_id, choice_id, bucket_start(start, to_resolution)] += votes
+                ids.append(bucket_id)
+            for start in range(0, len(ids), 500):
+                VoteBucket.objects.using(alias).filter(id__in=ids[start:start + 500]).delete()
+            for (question_id, choice_id, start), votes in merged.items():
+                add_to_bucket(question_id, choice_id, to_resolution, start, votes)
+        logger.info("Merged %d buckets of %ds into %d of %ds in %s",
+                    len(ids), resolution, len(merged), to_resolution, alias)
+        removed += len(ids)
+    return removed
+
+
+def downsample_all():
+    """Downsample minute buckets to hours and hour buckets to days."""
+    minute_hours = getattr(settings, 'POLLS_ROLLUP_MINUTE_RETENTION_HOURS', 48)
+    hour_days = getattr(settings, 'POLLS_ROLLUP_HOUR_RETENTION_DAYS', 30)
+    removed = downsample(VoteBucket.MINUTE, VoteBucket.HOUR, datetime.timedelta(hours=minute_hours))
+    removed += downsample(VoteBucket.HOUR, VoteBucket.DAY, datetime.timedelta(days=hour_days))
+    return removed
+
+
+def trend(question, choices):
+    """
+    Return ``(labels, {choice_id: [votes, ...]})`` with the running total of
+    every choice at the start of each bucket, read from the rollup table only.
+    """
+    totals = {choice.id: 0 for choice in choices}
+    labels = []
+    series = {choice.id: [] for choice in choices}
+    rows = (VoteBucket.objects.filter(question=question).order_by('start')
+            .values_list('start', 'choice_id', 'votes'))
+    for start, choice_id, votes in rows.iterator(chunk_size=10000):
+        if not labels or labels[-1] != start:
+            if labels:
+                for key, total in totals.items():
+                    series[key].append(total)
+            labels.append(start)
+        totals[choice_id] = totals.get(choice_id, 0) + votes
+    if labels:
+        for key, total in totals.items():
+            if key in series:
+                series[key].append(total)
+    return labels, series
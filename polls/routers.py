@@ -0,0 +1,48 @@
+"""Database router for the vote shards."""
+from django.db import DEFAULT_DB_ALIAS
+
+from .sharding import SHARDED_MODELS, shard_count, shard_for
+
+
+class VoteShardRouter:
+    """
+    Send Vote and VoteBucket to the shard of their question.
+
+    The shard is found from the ``instance`` hint: a vote, a bucket or a
+    choice carries a ``question_id``, a question is its own key. This covers
+    saves, deletes and related managers such as ``question.vote_set``.
+    Every other model is sent to the default database, even when reached
+    from a vote (``vote.user``), and nothing is routed when sharding is off.
+    """
+
+    def _shard(self, model, instance=None, **hints):
+        if not shard_count():
+            return None
+        if model._meta.model_name not in SHARDED_MODELS:
+            return DEFAULT_DB_ALIAS
+        if instance is None:
+            return None
+        question_id = getattr(instance, 'question_id', None)
+        if question_id is None and instance._meta.model_name == 'question':
+            question_id = instance.pk
+        if question_id is None:
+            return None
+        return shard_for(question_id)
+
+    db_for_read = _shard
+    db_for_write = _shard
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Votes and buckets point at rows of the default database."""
+        if {obj1._meta.model_name, obj2._meta.model_name} & SHARDED_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """
+        Shards hold only the sharded tables. The default database keeps them
+        too, empty, so that cascading deletes still find a table to look in.
+        """
+        if not db.startswith('votes_'):
+            return None
+        return app_label == 'polls' and model_name in SHARDED_MODELS
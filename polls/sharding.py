@@ -0,0 +1,130 @@
+"""Spread the Vote and VoteBucket tables over several SQLite databases by question."""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models
+
+# models whose rows live in the shard of their question
+SHARDED_MODELS = {'vote', 'votebucket'}
+
+
+def shard_count():
+    """Return the number of vote shards, 0 when sharding is off."""
+    return getattr(settings, 'POLLS_VOTE_SHARDS', 0)
+
+
+def shard_for(question_id):
+    """Return the database alias holding the votes of a question."""
+    shards = shard_count()
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    return f'votes_{question_id % shards}'
+
+
+def shard_aliases():
+    """Return the alias of every vote shard."""
+    shards = shard_count()
+    if not shards:
+        return [DEFAULT_DB_ALIAS]
+    return [f'votes_{shard}' for shard in range(shards)]
+
+
+def group_by_shard(items, question_id=lambda item: item):
+    """Return ``{alias: [items]}`` for items keyed by their question id."""
+    groups = defaultdict(list)
+    for item in items:
+        groups[shard_for(question_id(item))].append(item)
+    return groups
+
+
+def delete_rows(model, alias, column, value):
+    """Delete the rows of ``model`` where ``column = value`` with one statement, without signals."""
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE {column} = %s', [value])
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    QuerySet that picks the shard from the question it is filtered on.
+
+    ``filter(question=...)``, ``filter(question_id=...)`` and ``create()``
+    go to the shard of that question, bulk writes are split by shard. Queries
+    over several questions must say where to run with ``using()``, one shard
+    at a time, see :func:`shard_aliases` and :func:`group_by_shard`.
+    """
+
+    def _route(self, values):
+        if self._db is not None or not shard_count():
+            return self
+        question = values.get('question_id', values.get('question'))
+        if isinstance(question, models.Model):
+            question = question.pk
+        if isinstance(question, int):
+            return self.using(shard_for(question))
+        return self
+
+    def filter(self, *args, **kwargs):
+        return super(ShardedQuerySet, self._route(kwargs)).filter(*args, **kwargs)
+
+    def create(self, **kwargs):
+        return super(ShardedQuerySet, self._route(kwargs)).create(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        if self._db is not None or not shard_count():
+            return super().bulk_create(objs, *args, **kwargs)
+        for alias, shard_objs in group_by_shard(objs, lambda obj: obj.question_id).items():
+            super(ShardedQuerySet, self.using(alias)).bulk_create(shard_objs, *args, **kwargs)
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if self._db is not None or not shard_count():
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        for alias, shard_objs in group_by_shard(objs, lambda obj: obj.question_id).items():
+            super(ShardedQuerySet, self.using(alias)).bulk_update(shard_objs, fields, *args, **kwargs)
+
+
+def count_votes_by_choice(question_ids):
+    """
+    Return ``{choice_id: votes}`` of the given unarchived questions, with one
+    grouped query per shard holding some of them.
+    """
+    from .models import Vote
+
+    counts = Counter()
+    for alias, shard_question_ids in group_by_shard(question_ids).items():
+        rows = (Vote.objects.using(alias).filter(question_id__in=shard_question_ids)
+                .values_list('choice_id').annotate(votes=models.Count('id')).order_by())
+        counts.update(dict(rows))
+    return counts
+
+
+def annotate_leaders(questions):
+    """
+    Set ``vote_count``, ``leader_text`` and ``leader_votes`` on questions,
+    like ``QuestionQuerySet.with_leader()`` does in SQL when votes are not
+    sharded. Costs one query for the choices plus one per shard touched and
+    one for archived polls.
+    """
+    from .models import ArchivedTally, Choice
+
+    questions = list(questions)
+    live = [question.id for question in questions if question.archived_at is None]
+    archived = [question.id for question in questions if question.archived_at is not None]
+    counts = count_votes_by_choice(live)
+    if archived:
+        counts.update(dict(ArchivedTally.objects.filter(question_id__in=archived).values_list('choice_id', 'votes')))
+    leaders = {}
+    for choice in Choice.objects.filter(question__in=[question.id for question in questions]).order_by('id'):
+        votes = counts.get(choice.id, 0)
+        total, leader = leaders.get(choice.question_id, (0, None))
+        if leader is None or votes > counts.get(leader.id, 0):
+            leader = choice
+        leaders[choice.question_id] = (total + votes, leader)
+    for question in questions:
+        total, leader = leaders.get(question.id, (0, None))
+        question.vote_count = total
+        question.leader_text = leader.text if leader else None
+        question.leader_votes = counts.get(leader.id, 0) if leader else None
+    return questions
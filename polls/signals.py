@@ -0,0 +1,140 @@
+"""Keep the in-memory polls indexes in sync with the database."""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from .lifecycle import invalidate_published_questions, scheduler
+from .models import Choice, Question, Vote, VoteBucket
+from .payloads import invalidate_question_payload
+from .rollups import record_votes
+from .sharding import delete_rows, shard_aliases, shard_for
+from .tallies import forget_final_tally, get_tally_store
+from .voter_index import voter_index
+
+# Sent with question_id, user_id, old_choice_id and new_choice_id whenever a
+# vote is cast, changed or removed. Writes that bypass the model signals
+# (``update()``, bulk writes) send it themselves.
+vote_changed = Signal()
+# Sent with ``changes``, a list of (question_id, user_id, old_choice_id,
+# new_choice_id), by bulk writes. Every vote_changed is forwarded to it.
+votes_changed = Signal()
+
+
+@receiver(pre_save, sender=Vote)
+def remember_previous_choice(sender, instance, **kwargs):
+    """Remember the choice an existing vote is about to leave."""
+    if instance.pk is not None:
+        instance._previous_choice_id = (Vote.objects.filter(question_id=instance.question_id, pk=instance.pk)
+                                        .values_list('choice_id', flat=True).first())
+
+
+@receiver(post_save, sender=Vote)
+def vote_saved(sender, instance, **kwargs):
+    """Announce a new or changed vote."""
+    vote_changed.send(sender=Vote, question_id=instance.question_id, user_id=instance.user_id,
+                      old_choice_id=getattr(instance, '_previous_choice_id', None),
+                      new_choice_id=instance.choice_id)
+
+
+@receiver(post_delete, sender=Vote)
+def vote_deleted(sender, instance, **kwargs):
+    """Announce a deleted vote."""
+    vote_changed.send(sender=Vote, question_id=instance.question_id, user_id=instance.user_id,
+                      old_choice_id=instance.choice_id, new_choice_id=None)
+
+
+@receiver(vote_changed)
+def forward_vote_changed(sender, question_id, user_id, old_choice_id, new_choice_id, **kwargs):
+    """Handle a single vote like a batch of one."""
+    votes_changed.send(sender=sender, changes=[(question_id, user_id, old_choice_id, new_choice_id)])
+
+
+@receiver(votes_changed)
+def update_voter_index(sender, changes, **kwargs):
+    """Record the votes in the voter index."""
+    for question_id, user_id, _, new_choice_id in changes:
+        if new_choice_id is None:
+            voter_index.discard(question_id, user_id)
+        else:
+            voter_index.set(question_id, user_id, new_choice_id)
+
+
+@receiver(votes_changed)
+def update_tally_store(sender, changes, **kwargs):
+    """Move the votes between choices in the shared tally store."""
+    store = get_tally_store()
+    moves = [(question_id, old, new) for question_id, _, old, new in changes if old != new]
+    if store is not None and moves:
+        store.move_many(moves)
+
+
+@receiver(votes_changed)
+def update_rollups(sender, changes, **kwargs):
+    """Count the votes in the current minute bucket of the trend rollups."""
+    record_votes([(question_id, old, new) for question_id, _, old, new in changes if old != new])
+
+
+@receiver(votes_changed)
+def unfreeze_final_tallies(sender, changes, **kwargs):
+    """Drop the frozen results of closed polls whose votes still changed."""
+    forget_final_tally(*{question_id for question_id, _, old, new in changes if old != new})
+
+
+@receiver(pre_delete, sender=Question)
+def delete_question_votes(sender, instance, **kwargs):
+    """
+    Delete the votes and trend buckets of a question with one statement each
+    in its shard, rather than one signal per vote through a cascade.
+    """
+    alias = shard_for(instance.id)
+    delete_rows(Vote, alias, 'question_id', instance.id)
+    delete_rows(VoteBucket, alias, 'question_id', instance.id)
+
+
+@receiver(pre_delete, sender=Choice)
+def delete_choice_votes(sender, instance, **kwargs):
+    """Delete the votes and trend buckets of a choice, and forget who voted for it."""
+    alias = shard_for(instance.question_id)
+    delete_rows(Vote, alias, 'choice_id', instance.id)
+    delete_rows(VoteBucket, alias, 'choice_id', instance.id)
+    voter_index.discard(instance.question_id)
+    forget_final_tally(instance.question_id)
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_votes(sender, instance, **kwargs):
+    """
+    Delete the votes of a user from every shard with one statement each.
+    The polls they voted on stay, so the removals are announced in a batch.
+    """
+    for alias in shard_aliases():
+        changes = [(question_id, instance.id, choice_id, None) for question_id, choice_id in
+                   Vote.objects.using(alias).filter(user_id=instance.id).values_list('question_id', 'choice_id')]
+        if changes:
+            delete_rows(Vote, alias, 'user_id', instance.id)
+            votes_changed.send(sender=Vote, changes=changes)
+
+
+@receiver(post_delete, sender=Question)
+def question_deleted(sender, instance, **kwargs):
+    """Drop a deleted question from the voter index and the scheduler."""
+    voter_index.discard(instance.id)
+    scheduler.unschedule(instance.id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    """Drop the cached pages of a changed question and reschedule its transitions."""
+    invalidate_question_payload(instance.id)
+    invalidate_published_questions()
+    forget_final_tally(instance.id)
+    if kwargs['signal'] is post_save:
+        scheduler.schedule(instance)
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    """Drop the cached detail payload of the question of a changed choice."""
+    invalidate_question_payload(instance.question_id)
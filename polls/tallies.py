@@ -0,0 +1,274 @@
+"""Vote counts shared by every worker process on a host through an mmap file."""
+import logging
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import ArchivedTally, Choice, Vote
+from .sharding import count_votes_by_choice, shard_aliases
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger("polls")
+
+MAGIC = b'KUPT'
+VERSION = 1
+# magic, version, overflowed, capacity, used slots
+HEADER = struct.Struct('<4sIIQQ')
+# choice id (0 means empty), question id, votes
+SLOT = struct.Struct('<qqq')
+
+
+class TallyStore:
+    """
+    Fixed layout table of ``choice_id -> (question_id, votes)`` in a file.
+
+    Every worker maps the same file, so a vote counted by one worker is seen
+    by all the others without a query. Writers take an exclusive ``flock`` on
+    the file, readers only unpack the slots they need straight from the map.
+    Slots are found by linear probing on the choice id.
+
+    The counts drift when a worker dies in the middle of a write, when a vote
+    bypasses the ``vote_changed`` signal or when a vote is committed at the
+    very moment :meth:`reconcile` reads the database. :meth:`reconcile`
+    rebuilds them from :model:`polls.Vote`.
+
+    Property
+    --------
+    path: str
+        File that holds the table.
+    capacity: int
+        Number of slots, a table over 3/4 full stops being used.
+    """
+
+    def __init__(self, path, capacity):
+        self.path = str(path)
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = HEADER.size + capacity * SLOT.size
+        with self._locked():
+            fresh = os.fstat(self._fd).st_size != size
+            if fresh:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+            magic, version, _, file_capacity, _ = HEADER.unpack_from(self._map, 0)
+            if fresh or magic != MAGIC or version != VERSION or file_capacity != capacity:
+                self._clear()
+                HEADER.pack_into(self._map, 0, MAGIC, VERSION, 1, capacity, 0)
+        if self.overflowed:
+            # cold start, nobody has filled the table yet
+            self.reconcile()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the table for writing, against other threads and processes."""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _clear(self):
+        self._map[HEADER.size:] = bytes(len(self._map) - HEADER.size)
+
+    def _slot(self, choice_id, insert=False):
+        """Return the offset of the choice slot, or None if it is not stored."""
+        index = (choice_id * 2654435761) % self.capacity
+        for _ in range(self.capacity):
+            offset = HEADER.size + index * SLOT.size
+            stored_id = SLOT.unpack_from(self._map, offset)[0]
+            if stored_id == choice_id:
+                return offset
+            if stored_id == 0:
+                return offset if insert else None
+            index = (index + 1) % self.capacity
+        return None
+
+    def _header(self):
+        return HEADER.unpack_from(self._map, 0)
+
+    @property
+    def overflowed(self):
+        """True when the counts can not be trusted and the ORM must be used."""
+        return bool(self._header()[2])
+
+    def _add(self, question_id, choice_id, delta):
+        magic, version, overflowed, capacity, used = self._header()
+        offset = self._slot(choice_id, insert=True)
+        stored_id, _, votes = SLOT.unpack_from(self._map, offset)
+        if stored_id == 0:
+            if (used + 1) * 4 > capacity * 3:
+                HEADER.pack_into(self._map, 0, magic, version, 1, capacity, used)
+                logger.warning("Tally store %s is full, using the database", self.path)
+                return
+            HEADER.pack_into(self._map, 0, magic, version, overflowed, capacity, used + 1)
+        SLOT.pack_into(self._map, offset, choice_id, question_id, votes + delta)
+
+    def add(self, question_id, choice_id, delta=1):
+        """Add ``delta`` votes to a choice."""
+        with self._locked():
+            self._add(question_id, choice_id, delta)
+
+    def move(self, question_id, old_choice_id, new_choice_id):
+        """Move one vote from a choice to another in a single write."""
+        self.move_many([(question_id, old_choice_id, new_choice_id)])
+
+    def move_many(self, changes):
+        """Apply ``(question_id, old_choice_id, new_choice_id)`` moves in one write."""
+        with self._locked():
+            for question_id, old_choice_id, new_choice_id in changes:
+                if old_choice_id is not None:
+                    self._add(question_id, old_choice_id, -1)
+                if new_choice_id is not None:
+                    self._add(question_id, new_choice_id, 1)
+
+    def counts(self, choice_ids):
+        """
+        Return ``{choice_id: votes}`` read from the map without a query.
+
+        Return None when the table overflowed and can not answer.
+        """
+        if self.overflowed:
+            return None
+        counts = {}
+        for choice_id in choice_ids:
+            offset = self._slot(choice_id)
+            counts[choice_id] = 0 if offset is None else SLOT.unpack_from(self._map, offset)[2]
+        return counts
+
+    def _entries(self):
+        """Return ``{choice_id: (question_id, votes)}`` of every used slot."""
+        entries = {}
+        for offset in range(HEADER.size, len(self._map), SLOT.size):
+            choice_id, question_id, votes = SLOT.unpack_from(self._map, offset)
+            if choice_id:
+                entries[choice_id] = (question_id, votes)
+        return entries
+
+    def reconcile(self):
+        """
+        Rebuild every count from the Vote and ArchivedTally tables.
+
+        The table is not locked while the database is read, so the moves
+        applied meanwhile are measured against a snapshot taken before the
+        read and replayed on top of the rebuilt counts.
+        """
+        with self._locked():
+            before = self._entries()
+        rows = []
+        for alias in shard_aliases():
+            rows += (Vote.objects.using(alias).values_list('question_id', 'choice_id')
+                     .annotate(votes=Count('id')).order_by())
+        rows += ArchivedTally.objects.values_list('question_id', 'choice_id', 'votes')
+        with self._locked():
+            moved = []
+            for choice_id, (question_id, votes) in self._entries().items():
+                delta = votes - before.get(choice_id, (question_id, 0))[1]
+                if delta:
+                    moved.append((question_id, choice_id, delta))
+            self._clear()
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, 0, self.capacity, 0)
+            for question_id, choice_id, votes in rows + moved:
+                self._add(question_id, choice_id, votes)
+        logger.info("Tally store %s reconciled, %d choices, %d moved meanwhile", self.path, len(rows), len(moved))
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_tally_store():
+    """
+    Return the tally store of this process, or None when it is disabled.
+
+    The store is enabled by setting ``POLLS_TALLY_STORE`` to a file path,
+    the views then count votes with the ORM when it is empty.
+    """
+    path = getattr(settings, 'POLLS_TALLY_STORE', '')
+    if not path or fcntl is None:
+        return None
+    capacity = getattr(settings, 'POLLS_TALLY_CAPACITY', 65536)
+    with _stores_lock:
+        store = _stores.get((path, capacity))
+        if store is None:
+            store = _stores[(path, capacity)] = TallyStore(path, capacity)
+        return store
+
+
+def count_votes(question, choice_ids):
+    """Return ``{choice_id: votes}`` of a question in one query."""
+    if question.archived_at is not None:
+        rows = ArchivedTally.objects.filter(choice_id__in=choice_ids).values_list('choice_id', 'votes')
+    else:
+        rows = (Vote.objects.filter(question=question, choice_id__in=choice_ids).values_list('choice_id')
+                .annotate(votes=Count('id')).order_by())
+    counts = dict.fromkeys(choice_ids, 0)
+    counts.update(rows)
+    return counts
+
+
+def final_tally_key(question_id):
+    return f'polls:final:{question_id}'
+
+
+def freeze_final_tallies(question_ids):
+    """
+    Count the votes of closed, unarchived polls and cache them without
+    expiry, with one query for the choices and one per vote shard.
+    """
+    choices = (Choice.objects.filter(question_id__in=question_ids, question__archived_at__isnull=True)
+               .values_list('question_id', 'id'))
+    tallies = {}
+    for question_id, choice_id in choices:
+        tallies.setdefault(question_id, {})[choice_id] = 0
+    votes = count_votes_by_choice(list(tallies))
+    for counts in tallies.values():
+        for choice_id in counts:
+            counts[choice_id] = votes.get(choice_id, 0)
+    cache.set_many({final_tally_key(question_id): counts for question_id, counts in tallies.items()}, None)
+    return tallies
+
+
+def forget_final_tally(*question_ids):
+    """Drop the frozen results of the given questions."""
+    cache.delete_many([final_tally_key(question_id) for question_id in question_ids])
+
+
+def vote_counts(question, choices):
+    """
+    Return ``[(choice, votes), ...]``, from the tally store when enabled.
+
+    The results of a closed poll are counted once and frozen in the cache,
+    the signals drop them if a vote still changes afterwards.
+    """
+    choices = list(choices)
+    choice_ids = [choice.id for choice in choices]
+    closed = question.end_date is not None and question.end_date < timezone.now()
+    counts = cache.get(final_tally_key(question.id)) if closed else None
+    if counts is not None and set(counts) != set(choice_ids):
+        counts = None
+    if counts is None:
+        store = get_tally_store()
+        counts = store.counts(choice_ids) if store is not None else None
+        if counts is None:
+            counts = count_votes(question, choice_ids)
+        if closed:
+            cache.set(final_tally_key(question.id), counts, None)
+    return [(choice, counts[choice.id]) for choice in choices]
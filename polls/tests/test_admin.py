@@ -0,0 +1,101 @@
+import datetime
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..models import Question, Vote
+from ..querybudget import QueryBudget
+from ..sharding import shard_count, shard_for
+from ..tallies import final_tally_key
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class PollsAdminTests(TestCase):
+    """Test the admin of questions, choices and votes."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='admin', password='admin')
+        self.client.login(username='admin', password='admin')
+        self.question = create_question(question_text="Past question 1.", days=-30)
+        self.choice = self.question.choice_set.create(text="ans: 1")
+        for number in range(3):
+            user = User.objects.create_user(username=f'voter{number}')
+            Vote.objects.create(user=user, question=self.question, choice=self.choice)
+
+    def shard_filter(self):
+        """Return the vote list filter on the shard of the question, none without shards."""
+        return {'shard': shard_for(self.question.id)} if shard_count() else {}
+
+    def test_changelists_show_vote_counts(self):
+        """Question and choice lists show annotated vote counts."""
+        for model in ('question', 'choice'):
+            response = self.client.get(reverse(f'admin:polls_{model}_changelist'))
+            self.assertEqual(3, response.context['cl'].result_list[0].vote_count)
+
+    def test_vote_changelist(self):
+        """The vote list is paginated without a full count."""
+        response = self.client.get(reverse('admin:polls_vote_changelist'), self.shard_filter())
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, response.context['cl'].result_count)
+
+    def test_vote_count_ignores_deleted_ids(self):
+        """Votes removed from the table, e.g. by archival, are not counted."""
+        Vote.objects.filter(question=self.question, user=User.objects.get(username='voter0')).delete()
+        response = self.client.get(reverse('admin:polls_vote_changelist'), self.shard_filter())
+        self.assertEqual(2, response.context['cl'].paginator.count)
+
+    def test_close_polls_action(self):
+        """Closing polls sets their end date in one update."""
+        self.client.post(reverse('admin:polls_question_changelist'), {
+            'action': 'close_polls', '_selected_action': [self.question.id],
+        })
+        self.question.refresh_from_db()
+        self.assertFalse(self.question.can_vote())
+
+    def test_close_polls_action_is_set_based(self):
+        """Closing many polls freezes their results without a query per poll."""
+        questions = [self.question] + [create_question(question_text=f"Open {number}.", days=-1)
+                                       for number in range(4)]
+        for question in questions[1:]:
+            question.choice_set.create(text="ans: 1")
+        with QueryBudget(strict=True):
+            self.client.post(reverse('admin:polls_question_changelist'), {
+                'action': 'close_polls', '_selected_action': [question.id for question in questions],
+            })
+        self.assertEqual({self.choice.id: 3}, cache.get(final_tally_key(self.question.id)))
+        self.assertEqual(5, len(cache.get_many([final_tally_key(question.id) for question in questions])))
+
+    def test_recount_forgets_frozen_results(self):
+        """Recounting a closed poll drops its frozen results."""
+        self.client.post(reverse('admin:polls_question_changelist'), {
+            'action': 'close_polls', '_selected_action': [self.question.id],
+        })
+        self.client.post(reverse('admin:polls_question_changelist'), {
+            'action': 'recount_votes', '_selected_action': [self.question.id],
+        })
+        self.assertIsNone(cache.get(final_tally_key(self.question.id)))
+
+    def test_export_votes_action(self):
+        """Exporting streams one CSV line per vote."""
+        response = self.client.post(reverse('admin:polls_question_changelist'), {
+            'action': 'export_votes', '_selected_action': [self.question.id],
+        })
+        self.assertEqual(4, len(b''.join(response.streaming_content).splitlines()))
@@ -0,0 +1,63 @@
+import datetime
+import gzip
+import os
+import tempfile
+
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..archive import archive_closed_polls
+from ..models import Question, Vote
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class ArchiveTests(TestCase):
+    """Test archival of closed polls."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='test1', password='test1')
+        self.user2 = User.objects.create_user(username='test2', password='test2')
+        self.question = create_question(question_text="Old question.", days=-90, edays=-60)
+        self.choice1 = self.question.choice_set.create(text="ans: 1")
+        self.choice2 = self.question.choice_set.create(text="ans: 2")
+        Vote.objects.create(user=self.user1, question=self.question, choice=self.choice1)
+        Vote.objects.create(user=self.user2, question=self.question, choice=self.choice1)
+
+    def test_archive_moves_votes(self):
+        """Votes leave the Vote table and Choice.votes reads the archive."""
+        archive_closed_polls(datetime.timedelta(days=30))
+        self.assertFalse(Vote.objects.filter(question=self.question).exists())
+        self.question.refresh_from_db()
+        self.assertIsNotNone(self.question.archived_at)
+        self.assertFalse(self.question.can_vote())
+        self.assertEqual([2, 0], [choice.votes for choice in self.question.choice_set.order_by('id')])
+        response = self.client.get(reverse('polls:polls-results', args=[self.question.id]))
+        self.assertContains(response, "2 votes")
+
+    def test_recent_poll_not_archived(self):
+        """Polls closed more recently than the age keep their votes."""
+        self.assertEqual([], archive_closed_polls(datetime.timedelta(days=90)))
+        self.assertEqual(2, Vote.objects.filter(question=self.question).count())
+
+    def test_export(self):
+        """The votes are written to a compressed file when asked."""
+        with tempfile.TemporaryDirectory() as export_dir:
+            archive_closed_polls(datetime.timedelta(days=30), export_dir)
+            with gzip.open(os.path.join(export_dir, f'question-{self.question.id}.csv.gz'), 'rt') as export:
+                self.assertEqual(3, len(export.read().splitlines()))
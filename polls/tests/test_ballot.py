@@ -0,0 +1,99 @@
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..models import Question, Vote, VoteBucket
+from ..querybudget import QueryBudgetTestMixin
+from ..sharding import shard_aliases
+from ..voter_index import voter_index
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+def count_everywhere(model, **filters):
+    """Count the rows of a vote model in every shard."""
+    return sum(model.objects.using(alias).filter(**filters).count() for alias in shard_aliases())
+
+
+class BallotTests(QueryBudgetTestMixin, TestCase):
+    """Test voting on many questions in one request."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        voter_index.clear()
+        self.user = User.objects.create_user(username='test1', password='test1')
+        self.client.login(username='test1', password='test1')
+        self.url = reverse('polls:polls-ballot')
+        self.questions = []
+        for number in range(20):
+            question = create_question(question_text=f"Past question {number}.", days=-number - 1)
+            question.choice_set.create(text="ans: 1")
+            question.choice_set.create(text="ans: 2")
+            self.questions.append(question)
+
+    def ballot(self, index):
+        """Return the POST data voting for choice ``index`` of every question."""
+        return {f'question-{question.id}': question.choice_set.order_by('id')[index].id for question in self.questions}
+
+    def test_ballot_form(self):
+        """The ballot lists every open question with its choices."""
+        response = self.assertQueryBudget(self.url)[0]
+        self.assertEqual(20, len(response.context['questions']))
+
+    def test_ballot_form_ignores_bad_ids(self):
+        """Ids that are not numbers or too big for the database are left out of the ballot."""
+        too_big = '9' * 23
+        response = self.client.get(self.url, {'question': ['abc', too_big, self.questions[0].id]})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([self.questions[0]], [question for question, _ in response.context['questions']])
+        for data in ({f'question-{too_big}': self.questions[0].choice_set.first().id},
+                     {f'question-{self.questions[0].id}': too_big}):
+            response = self.client.post(self.url, data)
+            self.assertTemplateUsed(response, 'polls/ballot.html')
+        self.assertEqual(0, count_everywhere(Vote))
+
+    def test_vote_on_every_question(self):
+        """One request casts a vote on every question within the budget."""
+        response = self.assertQueryBudget(self.url, 'post', self.ballot(0))[0]
+        self.assertEqual(20, count_everywhere(Vote, user=self.user))
+        self.assertEqual(20, len(response.context['votes']))
+        self.assertEqual(20, count_everywhere(VoteBucket, votes=1))
+
+    def test_change_votes(self):
+        """A second ballot changes the existing votes."""
+        self.client.post(self.url, self.ballot(0))
+        response = self.assertQueryBudget(self.url, 'post', self.ballot(1))[0]
+        self.assertTrue(all(changed for _, _, changed in response.context['votes']))
+        self.assertEqual(20, count_everywhere(Vote, user=self.user))
+        second_choice = self.questions[0].choice_set.order_by('id')[1]
+        self.assertEqual(second_choice.id, voter_index.choice_for(self.questions[0].id, self.user.id))
+
+    def test_invalid_ballot_writes_nothing(self):
+        """A choice that does not belong to its question rejects the ballot."""
+        data = self.ballot(0)
+        data[f'question-{self.questions[0].id}'] = self.questions[1].choice_set.first().id
+        response = self.client.post(self.url, data)
+        self.assertTemplateUsed(response, 'polls/ballot.html')
+        self.assertEqual(0, count_everywhere(Vote))
+
+    def test_closed_question_rejected(self):
+        """A closed poll can not be voted on through a ballot."""
+        closed = create_question(question_text="Closed question.", days=-5, edays=-1)
+        choice = closed.choice_set.create(text="ans: 1")
+        self.client.post(self.url, {f'question-{closed.id}': choice.id})
+        self.assertEqual(0, count_everywhere(Vote))
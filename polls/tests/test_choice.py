@@ -22,6 +22,8 @@ def create_question(question_text, days, edays=None):
 class ChoiceTests(TestCase):
     """Test Choice String"""
 
+    databases = '__all__'
+
     def test_choice_str(self):
         """Choice __str__ return name of the answer follow this format<Choice: 'choice_name'>"""
         past_question = create_question(question_text="Past question 1.", days=-30)
@@ -22,6 +22,8 @@ def create_question(question_text, days, edays=None):
 class QuestionDetailViewTests(TestCase):
     """Test for question detail page."""
 
+    databases = '__all__'
+
     def test_future_question(self):
         """
         The detail view of a question with a pub_date in the future
@@ -3,7 +3,9 @@ import datetime
 from django.test import TestCase
 from django.utils import timezone
 from django.urls import reverse
-from ..models import Question
+from django.contrib.auth.models import User
+from ..models import Question, Vote
+from ..sharding import shard_count
 
 
 def create_question(question_text, days, edays=None):
@@ -23,6 +25,8 @@ def create_question(question_text, days, edays=None):
 class QuestionHomeViewTests(TestCase):
     """Question on home page"""
 
+    databases = '__all__'
+
     def test_no_questions(self):
         """If no questions exist, an appropriate message is displayed."""
         response = self.client.get(reverse('polls:polls-home'))
@@ -94,3 +98,38 @@ class QuestionHomeViewTests(TestCase):
                 '<Question: Past question 2.>',
             ]
         )
+
+
+class QuestionLeaderboardTests(TestCase):
+    """Vote totals and leading choice on the home page."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.question = create_question(question_text="Past question.", days=-30)
+        self.choice1 = self.question.choice_set.create(text="ans: 1")
+        self.choice2 = self.question.choice_set.create(text="ans: 2")
+        for number in range(3):
+            user = User.objects.create_user(username=f'voter{number}')
+            choice = self.choice2 if number else self.choice1
+            Vote.objects.create(user=user, question=self.question, choice=choice)
+
+    def test_leader_annotated(self):
+        """Each question carries its total and leading choice."""
+        response = self.client.get(reverse('polls:polls-home'))
+        question = response.context['latest_question_list'][0]
+        self.assertEqual((3, "ans: 2", 2), (question.vote_count, question.leader_text, question.leader_votes))
+        self.assertContains(response, "3 votes, leading: ans: 2 (2)")
+
+    def test_constant_queries(self):
+        """
+        The list costs one query whatever the number of polls, once the
+        published ones are known, and one more for the choices with shards.
+        """
+        for number in range(4):
+            question = create_question(question_text=f"Past question {number}.", days=-number - 1)
+            question.choice_set.create(text="ans: 1")
+        with self.assertNumQueries(4 if shard_count() else 3):
+            self.client.get(reverse('polls:polls-home'))
+        with self.assertNumQueries(2 if shard_count() else 1):
+            self.client.get(reverse('polls:polls-home'))
@@ -0,0 +1,122 @@
+import datetime
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..lifecycle import CLOSE, OPEN, TRANSITIONS, LifecycleScheduler, cache_timeout, open_poll, close_poll
+from ..models import Question, Vote
+from ..sharding import shard_count
+from ..tallies import final_tally_key
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class LifecycleTests(TestCase):
+    """Test the poll open and close transitions."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='test1', password='test1')
+        self.question = create_question(question_text="Future question.", days=1, edays=2)
+        self.choice1 = self.question.choice_set.create(text="ans: 1")
+        self.choice2 = self.question.choice_set.create(text="ans: 2")
+
+    def test_scheduler_fires_in_order(self):
+        """Each poll opens, then closes, when its dates come."""
+        scheduler = LifecycleScheduler()
+        scheduler.running = True
+        self.assertEqual(scheduler.load(), 2)
+        self.assertEqual(scheduler.next_at(), self.question.pub_date)
+        self.assertEqual(scheduler.run_pending(), [])
+        later = timezone.now() + datetime.timedelta(days=3)
+        self.assertEqual(scheduler.run_pending(later), [(OPEN, self.question.id), (CLOSE, self.question.id)])
+        self.assertIsNone(scheduler.next_at())
+
+    def test_edited_dates_are_rescheduled(self):
+        """Moving a poll drops its old transitions."""
+        scheduler = LifecycleScheduler()
+        scheduler.running = True
+        scheduler.load()
+        self.question.pub_date += datetime.timedelta(days=5)
+        self.question.end_date = None
+        scheduler.schedule(self.question)
+        self.assertEqual(scheduler.run_pending(timezone.now() + datetime.timedelta(days=3)), [])
+        self.assertEqual(scheduler.run_pending(timezone.now() + datetime.timedelta(days=7)),
+                         [(OPEN, self.question.id)])
+
+    def test_far_dates_do_not_stop_the_thread(self):
+        """A poll that never closes (year 9999) leaves the scheduler running."""
+        never = datetime.datetime(9999, 12, 31, tzinfo=datetime.timezone.utc)
+        self.assertEqual(LifecycleScheduler().wait_timeout(timezone.now()), 30)
+        fired = []
+        scheduler = LifecycleScheduler()
+        # the thread can not read the rows of the test transaction
+        scheduler.load = lambda: 0
+        with mock.patch.dict(TRANSITIONS, {OPEN: fired.append}):
+            scheduler.start()
+            try:
+                self.assertTrue(scheduler.loaded.wait(5))
+                scheduler.schedule(Question(id=1, pub_date=timezone.now() - datetime.timedelta(days=1), end_date=never))
+                self.assertEqual(scheduler.wait_timeout(timezone.now()), 30)
+                scheduler.schedule(Question(id=2, pub_date=timezone.now() + datetime.timedelta(seconds=0.2)))
+                for _ in range(50):
+                    if fired:
+                        break
+                    time.sleep(0.1)
+                self.assertTrue(scheduler._thread.is_alive())
+            finally:
+                scheduler.stop()
+        self.assertEqual(fired, [2])
+
+    def test_home_list_refreshed_on_open(self):
+        """The cached home list picks up a poll when it opens."""
+        self.assertNotContains(self.client.get(reverse('polls:polls-home')), "Future question.")
+        # reaching the publication date is not a save, the list is still cached
+        Question.objects.filter(pk=self.question.pk).update(pub_date=timezone.now())
+        self.assertNotContains(self.client.get(reverse('polls:polls-home')), "Future question.")
+        open_poll(self.question.id)
+        # the choices are read apart from the questions with shards
+        with self.assertNumQueries(2 if shard_count() else 1):
+            response = self.client.get(reverse('polls:polls-home'))
+        self.assertContains(response, "Future question.")
+
+    def test_home_list_expires_at_next_opening(self):
+        """The home list is cached until the next poll opens, at most the max timeout."""
+        now = timezone.now()
+        self.assertEqual(cache_timeout(now + datetime.timedelta(seconds=20), now), 21)
+        self.assertEqual(cache_timeout(now + datetime.timedelta(days=30), now), 30)
+        self.assertEqual(cache_timeout(None, now), 30)
+
+    def test_results_frozen_on_close(self):
+        """A closed poll's results are counted once, until a vote changes."""
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        now = timezone.now()
+        Question.objects.filter(pk=self.question.pk).update(pub_date=now - datetime.timedelta(days=2), end_date=now)
+        close_poll(self.question.id)
+        self.assertEqual(cache.get(final_tally_key(self.question.id)), {self.choice1.id: 1, self.choice2.id: 0})
+        url = reverse('polls:polls-results', args=(self.question.id,))
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual([votes for _, votes in response.context['choice_votes']], [1, 0])
+        Vote.objects.filter(question=self.question, user=self.user).delete()
+        self.assertIsNone(cache.get(final_tally_key(self.question.id)))
+        response = self.client.get(url)
+        self.assertEqual([votes for _, votes in response.context['choice_votes']], [0, 0])
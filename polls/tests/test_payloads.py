@@ -0,0 +1,55 @@
+import datetime
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from ..models import Question
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class QuestionPayloadTests(TestCase):
+    """Test the cached question payload of the detail page."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Past question 1.", days=-30)
+        self.question.choice_set.create(text="ans: 1")
+        self.question.choice_set.create(text="ans: 2")
+        self.url = reverse('polls:polls-detail', args=[self.question.id])
+
+    def test_one_query_on_miss_none_on_hit(self):
+        """The detail page costs one query, then none once cached."""
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, "ans: 2")
+
+    def test_invalidated_on_choice_save(self):
+        """A new choice shows up on the next request."""
+        self.client.get(self.url)
+        self.question.choice_set.create(text="ans: 3")
+        self.assertContains(self.client.get(self.url), "ans: 3")
+
+    def test_invalidated_on_question_save(self):
+        """A question moved to the future is no longer shown."""
+        self.client.get(self.url)
+        self.question.pub_date = timezone.now() + datetime.timedelta(days=1)
+        self.question.save()
+        self.assertEqual(404, self.client.get(self.url).status_code)
@@ -0,0 +1,93 @@
+import datetime
+from types import SimpleNamespace
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..models import Question
+from ..querybudget import QueryBudget, QueryBudgetExceeded, QueryBudgetTestMixin, query_shape, sharded_budget
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    """Test the query budget of every polls route."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='test1', password='test1')
+        self.client.login(username='test1', password='test1')
+        for number in range(6):
+            self.question = create_question(question_text=f"Past question {number}.", days=-number - 1)
+        self.choices = [self.question.choice_set.create(text=f"ans: {number}") for number in range(5)]
+
+    def test_query_shape(self):
+        """Queries that only differ by their values have the same shape."""
+        self.assertEqual(query_shape("SELECT * FROM t WHERE id IN (%s, %s) LIMIT 21"),
+                         query_shape("SELECT * FROM t WHERE id IN (%s, %s, %s) LIMIT 1"))
+
+    def test_n_plus_one_detected(self):
+        """Running the same query for every choice fails in strict mode."""
+        with self.assertRaises(QueryBudgetExceeded):
+            with QueryBudget(strict=True):
+                for choice in self.question.choice_set.all():
+                    choice.votes
+
+    def test_shard_fan_out_is_not_n_plus_one(self):
+        """The same query run once per shard is not an N+1."""
+        recorder = QueryBudget(strict=True)
+        for alias in ('votes_0', 'votes_1', 'votes_2', 'votes_0'):
+            recorder(lambda *args: None, "SELECT 1", (), False, {'connection': SimpleNamespace(alias=alias)})
+        recorder.check()
+        recorder(lambda *args: None, "SELECT 1", (), False, {'connection': SimpleNamespace(alias='votes_0')})
+        self.assertEqual({"SELECT ?": 3}, recorder.repeated())
+
+    def test_sharded_budget(self):
+        """Views that query every shard are allowed more queries with more shards."""
+        with override_settings(POLLS_VOTE_SHARDS=0):
+            self.assertEqual(5, sharded_budget(5, sharded=6, per_shard=1))
+        with override_settings(POLLS_VOTE_SHARDS=4):
+            self.assertEqual(10, sharded_budget(5, sharded=6, per_shard=1))
+            self.assertEqual(4, sharded_budget(4))
+
+    def test_budget_exceeded(self):
+        """Going over the budget fails in strict mode."""
+        with self.assertRaises(QueryBudgetExceeded):
+            with QueryBudget(1, strict=True):
+                list(Question.objects.all())
+                list(Question.objects.all())
+
+    def test_read_routes(self):
+        """Every page stays within its budget."""
+        for name in ('polls:polls-detail', 'polls:polls-results', 'polls:polls-pie-chart', 'polls:polls-trend'):
+            self.assertQueryBudget(reverse(name, args=[self.question.id]))
+        self.assertQueryBudget(reverse('polls:polls-home'))
+        self.assertQueryBudget(reverse('polls:signup'))
+
+    def test_vote_route(self):
+        """Casting and changing a vote stay within the budget."""
+        url = reverse('polls:polls-vote', args=[self.question.id])
+        self.assertQueryBudget(url, 'post', {'choice': self.choices[0].id})
+        self.assertQueryBudget(url, 'post', {'choice': self.choices[1].id})
+        self.assertQueryBudget(url, 'post', {})
+
+    def test_signup_route(self):
+        """Signing up stays within the budget."""
+        self.client.logout()
+        self.assertQueryBudget(reverse('polls:signup'), 'post', {
+            'username': 'test2', 'password1': 'Xyzzy-12345', 'password2': 'Xyzzy-12345',
+        })
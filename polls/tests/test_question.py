@@ -9,6 +9,8 @@ from ..models import Question
 class QuestionModelTests(TestCase):
     """Test for Question polls."""
 
+    databases = '__all__'
+
     def test_was_published_recently_with_future_question(self):
         """
         was_published_recently() returns False for questions
@@ -0,0 +1,122 @@
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..models import Question, Vote, VoteBucket
+from ..rollups import bucket_start, downsample, record_vote, trend
+from ..voter_index import voter_index
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class RollupTests(TestCase):
+    """Test the time bucketed vote rollups."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='test1', password='test1')
+        self.question = create_question(question_text="Past question 1.", days=-30)
+        self.choice1 = self.question.choice_set.create(text="ans: 1")
+        self.choice2 = self.question.choice_set.create(text="ans: 2")
+
+    def test_vote_is_bucketed(self):
+        """A new vote adds one to the choice's minute bucket."""
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        bucket = VoteBucket.objects.get(question=self.question, choice=self.choice1)
+        self.assertEqual((VoteBucket.MINUTE, 1), (bucket.resolution, bucket.votes))
+
+    def test_changed_vote_moves_between_choices(self):
+        """Changing a vote removes it from the old choice's bucket."""
+        self.client.login(username='test1', password='test1')
+        url = reverse('polls:polls-vote', args=[self.question.id])
+        self.client.post(url, {'choice': self.choice1.id})
+        self.client.post(url, {'choice': self.choice2.id})
+        labels, series = trend(self.question, [self.choice1, self.choice2])
+        self.assertEqual({self.choice1.id: [0], self.choice2.id: [1]}, series)
+
+    def test_vote_changed_in_another_worker(self):
+        """A stale voter index does not move the vote from the wrong choice."""
+        voter_index.clear()
+        self.client.login(username='test1', password='test1')
+        url = reverse('polls:polls-vote', args=[self.question.id])
+        self.client.post(url, {'choice': self.choice1.id})
+        voter_index.warm(self.question.id)
+        # what this worker believes after missing a change made elsewhere
+        voter_index.set(self.question.id, self.user.id, self.choice2.id)
+        self.client.post(url, {'choice': self.choice2.id})
+        labels, series = trend(self.question, [self.choice1, self.choice2])
+        self.assertEqual({self.choice1.id: [0], self.choice2.id: [1]}, series)
+
+    def test_trend_running_total(self):
+        """The trend is the running total at each bucket."""
+        earlier = timezone.now() - datetime.timedelta(hours=2)
+        record_vote(self.question.id, None, self.choice1.id, earlier)
+        record_vote(self.question.id, None, self.choice2.id)
+        labels, series = trend(self.question, [self.choice1, self.choice2])
+        self.assertEqual(2, len(labels))
+        self.assertEqual({self.choice1.id: [1, 1], self.choice2.id: [0, 1]}, series)
+        response = self.client.get(reverse('polls:polls-trend', args=[self.question.id]))
+        self.assertContains(response, "trend-chart")
+
+    def test_downsample(self):
+        """Old minute buckets are merged into one hour bucket."""
+        hour = bucket_start(timezone.now() - datetime.timedelta(days=3), VoteBucket.HOUR)
+        record_vote(self.question.id, None, self.choice1.id, hour)
+        record_vote(self.question.id, None, self.choice1.id, hour + datetime.timedelta(minutes=5))
+        self.assertEqual(2, downsample(VoteBucket.MINUTE, VoteBucket.HOUR, datetime.timedelta(days=1)))
+        bucket = VoteBucket.objects.get(question=self.question, choice=self.choice1)
+        self.assertEqual((VoteBucket.HOUR, hour, 2), (bucket.resolution, bucket.start, bucket.votes))
+
+    def test_delete_voted_choice(self):
+        """Deleting a voted choice leaves none of its buckets behind."""
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        self.choice1.delete()
+        self.assertFalse(VoteBucket.objects.filter(question_id=self.question.id).exists())
+
+    def test_delete_voted_question(self):
+        """Deleting a voted question leaves none of its buckets behind."""
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        Vote.objects.create(user=User.objects.create_user(username='test2'), question=self.question,
+                            choice=self.choice2)
+        self.question.delete()
+        self.assertFalse(VoteBucket.objects.filter(question_id=self.question.id).exists())
+
+    def test_delete_question_without_loading_votes(self):
+        """The votes of a deleted question go in one statement, not one by one."""
+        users = [User.objects.create_user(username=f'voter{number}') for number in range(30)]
+        Vote.objects.bulk_create(Vote(user=user, question=self.question, choice=self.choice1) for user in users)
+        with CaptureQueriesContext(connection) as queries:
+            self.question.delete()
+        self.assertLess(len(queries), 15)
+        self.assertFalse(Vote.objects.filter(question_id=self.question.id).exists())
+
+    def test_delete_user_moves_their_votes_out(self):
+        """Deleting a voter removes their vote from the trend of a poll that stays."""
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        self.user.delete()
+        labels, series = trend(self.question, [self.choice1, self.choice2])
+        self.assertEqual({self.choice1.id: [0], self.choice2.id: [0]}, series)
+        self.assertFalse(Vote.objects.filter(question_id=self.question.id).exists())
+
+    def test_trend_without_votes(self):
+        """A poll without buckets shows no chart and no chart script."""
+        response = self.client.get(reverse('polls:polls-trend', args=[self.question.id]))
+        self.assertContains(response, "No votes yet.")
+        self.assertNotContains(response, "trend-chart")
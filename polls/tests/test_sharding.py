@@ -0,0 +1,170 @@
+import datetime
+import tempfile
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..models import Question, Vote, VoteBucket
+from ..routers import VoteShardRouter
+from ..sharding import annotate_leaders, group_by_shard, shard_aliases, shard_for
+from ..voter_index import voter_index
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class ShardMapTests(SimpleTestCase):
+    """Test how questions are mapped to shards."""
+
+    def test_no_shards(self):
+        """Without shards every question is in the default database."""
+        with override_settings(POLLS_VOTE_SHARDS=0):
+            self.assertEqual(shard_for(7), DEFAULT_DB_ALIAS)
+            self.assertEqual(shard_aliases(), [DEFAULT_DB_ALIAS])
+
+    @override_settings(POLLS_VOTE_SHARDS=4)
+    def test_shard_for(self):
+        """A question goes to the shard of its id modulo the shard count."""
+        self.assertEqual(shard_for(7), 'votes_3')
+        self.assertEqual(shard_aliases(), ['votes_0', 'votes_1', 'votes_2', 'votes_3'])
+        self.assertEqual(dict(group_by_shard([1, 5, 2])), {'votes_1': [1, 5], 'votes_2': [2]})
+
+    @override_settings(POLLS_VOTE_SHARDS=2)
+    def test_router(self):
+        """Votes follow their question, other models stay on default."""
+        router = VoteShardRouter()
+        self.assertEqual(router.db_for_write(Vote, instance=Vote(question_id=3)), 'votes_1')
+        self.assertEqual(router.db_for_read(Vote, instance=Question(pk=4)), 'votes_0')
+        self.assertEqual(router.db_for_read(User, instance=Vote(question_id=3)), DEFAULT_DB_ALIAS)
+        self.assertIsNone(router.db_for_read(Vote))
+        self.assertTrue(router.allow_migrate('votes_0', 'polls', 'vote'))
+        self.assertFalse(router.allow_migrate('votes_0', 'polls', 'question'))
+        self.assertIsNone(router.allow_migrate('default', 'polls', 'question'))
+
+
+@skipUnless(getattr(settings, 'POLLS_VOTE_SHARDS', 0) >= 2, "set POLLS_VOTE_SHARDS=2 to test the shards")
+class ShardedVoteTests(TestCase):
+    """Test voting with votes spread over shards."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        voter_index.clear()
+        self.user = User.objects.create_user(username='test1', password='test1')
+        self.client.login(username='test1', password='test1')
+        self.question1 = create_question(question_text="Question 1.", days=-1)
+        self.question2 = create_question(question_text="Question 2.", days=-1)
+        self.choice1 = self.question1.choice_set.create(text="ans: 1")
+        self.choice2 = self.question2.choice_set.create(text="ans: 2")
+
+    def test_vote_goes_to_question_shard(self):
+        """A vote is written to the shard of its question only."""
+        self.client.post(reverse('polls:polls-vote', args=(self.question1.id,)), {'choice': self.choice1.id})
+        alias = shard_for(self.question1.id)
+        self.assertEqual(Vote.objects.using(alias).filter(question_id=self.question1.id).count(), 1)
+        self.assertFalse(Vote.objects.using(DEFAULT_DB_ALIAS).exists())
+        self.assertEqual(self.choice1.votes, 1)
+        self.assertEqual(VoteBucket.objects.using(alias).get(choice_id=self.choice1.id).votes, 1)
+
+    def test_ballot_and_leaders(self):
+        """A ballot writes to every shard and the home page counts them all."""
+        self.client.post(reverse('polls:polls-ballot'), {
+            f'question-{self.question1.id}': self.choice1.id,
+            f'question-{self.question2.id}': self.choice2.id,
+        })
+        self.assertNotEqual(shard_for(self.question1.id), shard_for(self.question2.id))
+        questions = annotate_leaders([self.question1, self.question2])
+        self.assertEqual([question.vote_count for question in questions], [1, 1])
+        self.assertEqual(questions[1].leader_text, "ans: 2")
+
+    def test_delete_question_deletes_sharded_votes(self):
+        """Deleting a question removes its votes from its shard."""
+        Vote.objects.create(user=self.user, question=self.question1, choice=self.choice1)
+        alias = shard_for(self.question1.id)
+        self.question1.delete()
+        self.assertFalse(Vote.objects.using(alias).exists())
+
+    def test_admin_opens_vote_of_its_shard(self):
+        """Vote ids repeat across shards, the admin goes by the shard in the URL."""
+        User.objects.filter(pk=self.user.pk).update(is_staff=True, is_superuser=True)
+        Vote.objects.create(id=7, user=self.user, question=self.question1, choice=self.choice1)
+        Vote.objects.create(id=7, user=self.user, question=self.question2, choice=self.choice2)
+        url = reverse('admin:polls_vote_change', args=[7])
+        for question in (self.question1, self.question2):
+            response = self.client.get(url, {'shard': shard_for(question.id)})
+            self.assertEqual(question.id, response.context['original'].question_id)
+        self.assertEqual(302, self.client.get(url).status_code)
+        response = self.client.get(reverse('admin:polls_vote_changelist'), {'shard': shard_for(self.question2.id)})
+        self.assertContains(response, f'shard={shard_for(self.question2.id)}">7</a>')
+
+    def test_rebalance(self):
+        """Votes left in the wrong database are moved to their shard."""
+        Vote.objects.using(DEFAULT_DB_ALIAS).create(user=self.user, question=self.question1, choice=self.choice1)
+        call_command('rebalance_vote_shards', stdout=StringIO())
+        self.assertFalse(Vote.objects.using(DEFAULT_DB_ALIAS).exists())
+        self.assertEqual(Vote.objects.using(shard_for(self.question1.id)).count(), 1)
+
+    def test_rebalance_after_dropping_shards(self):
+        """Votes of a shard no longer configured are found in its file and moved."""
+        with tempfile.TemporaryDirectory() as shard_dir:
+            # the file a higher POLLS_VOTE_SHARDS left behind
+            connections.databases['votes_9'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': f'{shard_dir}/votes_9.sqlite3'}
+            try:
+                with connections['votes_9'].schema_editor() as editor:
+                    editor.create_model(Vote)
+                    editor.create_model(VoteBucket)
+                Vote.objects.using('votes_9').bulk_create([Vote(user=self.user, question=self.question1, choice=self.choice1)])
+            finally:
+                connections['votes_9'].close()
+                del connections['votes_9']
+                del connections.databases['votes_9']
+            out = StringIO()
+            call_command('rebalance_vote_shards', shard_dir=shard_dir, stdout=out)
+        self.assertIn("Moved 1 votes out of votes_9", out.getvalue())
+        self.assertNotIn('votes_9', connections.databases)
+        self.assertEqual(Vote.objects.using(shard_for(self.question1.id)).get().choice_id, self.choice1.id)
+
+    def test_rebalance_merges_clashes(self):
+        """Buckets found on both sides are added up and a user's newest vote is kept."""
+        alias = shard_for(self.question1.id)
+        choice = self.question1.choice_set.create(text="ans: 3")
+        now = timezone.now()
+        Vote.objects.using(alias).bulk_create([
+            Vote(user=self.user, question=self.question1, choice=self.choice1, voted_at=now - datetime.timedelta(hours=1))])
+        Vote.objects.using(DEFAULT_DB_ALIAS).bulk_create([
+            Vote(user=self.user, question=self.question1, choice=choice, voted_at=now)])
+        start = now.replace(second=0, microsecond=0)
+        for db, votes in ((alias, 2), (DEFAULT_DB_ALIAS, 3)):
+            VoteBucket.objects.using(db).bulk_create([VoteBucket(
+                question=self.question1, choice=self.choice1, resolution=VoteBucket.MINUTE, start=start, votes=votes)])
+        call_command('rebalance_vote_shards', stdout=StringIO())
+        self.assertEqual(Vote.objects.using(alias).get().choice_id, choice.id)
+        self.assertEqual(VoteBucket.objects.using(alias).get().votes, 5)
+        self.assertFalse(VoteBucket.objects.using(DEFAULT_DB_ALIAS).exists())
+
+    def test_delete_user_deletes_sharded_votes(self):
+        """Deleting a user removes their votes from every shard and from the counts."""
+        Vote.objects.create(user=self.user, question=self.question1, choice=self.choice1)
+        Vote.objects.create(user=self.user, question=self.question2, choice=self.choice2)
+        self.user.delete()
+        for alias in shard_aliases():
+            self.assertFalse(Vote.objects.using(alias).exists())
+        self.assertEqual(self.choice1.votes, 0)
+        self.assertEqual(self.choice2.votes, 0)
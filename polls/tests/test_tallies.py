@@ -0,0 +1,110 @@
+import datetime
+import os
+import tempfile
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..models import Question, Vote
+from ..tallies import TallyStore, get_tally_store, _stores
+from ..voter_index import voter_index
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class TallyStoreTests(TestCase):
+    """Test the shared mmap tally store."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        voter_index.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'tallies')
+        self.user = User.objects.create_user(username='test1', password='test1')
+        self.question = create_question(question_text="Past question 1.", days=-30)
+        self.choice1 = self.question.choice_set.create(text="ans: 1")
+        self.choice2 = self.question.choice_set.create(text="ans: 2")
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+
+    def tearDown(self):
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+        self.tmpdir.cleanup()
+
+    def test_disabled_by_default(self):
+        """Without a path the ORM is used."""
+        with override_settings(POLLS_TALLY_STORE=''):
+            self.assertIsNone(get_tally_store())
+
+    def test_cold_start_rebuilds_from_database(self):
+        """A new file is filled from the Vote table."""
+        store = TallyStore(self.path, 64)
+        self.assertEqual({self.choice1.id: 1, self.choice2.id: 0},
+                         store.counts([self.choice1.id, self.choice2.id]))
+        store.close()
+
+    def test_survives_restart(self):
+        """Counts written by one process are there when the file is reopened."""
+        store = TallyStore(self.path, 64)
+        store.add(self.question.id, self.choice2.id, 5)
+        store.close()
+        store = TallyStore(self.path, 64)
+        self.assertEqual({self.choice2.id: 5}, store.counts([self.choice2.id]))
+        store.reconcile()
+        self.assertEqual({self.choice2.id: 0}, store.counts([self.choice2.id]))
+        store.close()
+
+    def test_reconcile_keeps_moves_made_meanwhile(self):
+        """A vote counted by another worker while the database is read is kept."""
+        store = TallyStore(self.path, 64)
+        other = TallyStore(self.path, 64)
+        moved = []
+
+        def move_during_read(execute, sql, params, many, context):
+            if not moved:
+                moved.append(True)
+                other.move(self.question.id, None, self.choice2.id)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(move_during_read):
+            store.reconcile()
+        self.assertEqual({self.choice1.id: 1, self.choice2.id: 1},
+                         store.counts([self.choice1.id, self.choice2.id]))
+        other.close()
+        store.close()
+
+    def test_overflow_falls_back(self):
+        """A full table stops answering instead of returning wrong counts."""
+        store = TallyStore(self.path, 4)
+        for choice_id in range(100, 110):
+            store.add(self.question.id, choice_id)
+        self.assertIsNone(store.counts([self.choice1.id]))
+        store.close()
+
+    def test_vote_updates_store(self):
+        """Casting and changing a vote moves the shared counts."""
+        with override_settings(POLLS_TALLY_STORE=self.path):
+            store = get_tally_store()
+            self.client.login(username='test1', password='test1')
+            url = reverse('polls:polls-vote', args=[self.question.id])
+            self.client.post(url, {'choice': self.choice2.id})
+            self.assertEqual({self.choice1.id: 0, self.choice2.id: 1},
+                             store.counts([self.choice1.id, self.choice2.id]))
+            response = self.client.get(reverse('polls:polls-results', args=[self.question.id]))
+            self.assertEqual([(self.choice1, 0), (self.choice2, 1)], response.context['choice_votes'])
@@ -25,6 +25,8 @@ def create_question(question_text, days, edays=None):
 class ResultViewTest(TestCase):
     """Test result view page"""
 
+    databases = '__all__'
+
     def setUp(self):
         self.fake_request = RequestFactory().request()
         self.login_url = reverse('login')
@@ -0,0 +1,124 @@
+import datetime
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from django.contrib.auth.models import User
+from ..models import Question, Vote
+from ..sharding import shard_for
+from ..voter_index import MERGE_AT, VoterIndex, voter_index
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class VoterIndexTests(TestCase):
+    """Test the per question voter index."""
+
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        voter_index.clear()
+        self.user = User.objects.create_user(username='test1', password='test1')
+        self.question = create_question(question_text="Past question 1.", days=-30)
+        self.choice1 = self.question.choice_set.create(text="ans: 1")
+        self.choice2 = self.question.choice_set.create(text="ans: 2")
+
+    def test_warm_from_vote_table(self):
+        """A warmed question is loaded from the existing votes."""
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        index = VoterIndex()
+        index.warm(self.question.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.choice1.id, index.choice_for(self.question.id, self.user.id))
+        self.assertGreater(index.memory_usage(self.question.id), 0)
+
+    def test_lookup_without_query_when_warm(self):
+        """A loaded question answers without touching the database."""
+        voter_index.warm(self.question.id)
+        with self.assertNumQueries(0):
+            self.assertIsNone(voter_index.choice_for(self.question.id, self.user.id))
+
+    def test_cold_lookup_reads_one_row(self):
+        """A cold question is answered with one single-row query, then loaded once hot."""
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        index = VoterIndex(load_after=3)
+        for _ in range(2):
+            with self.assertNumQueries(1, using=shard_for(self.question.id)):
+                self.assertEqual(self.choice1.id, index.choice_for(self.question.id, self.user.id))
+        self.assertEqual({}, index.stats())
+        index.choice_for(self.question.id, self.user.id)
+        self.assertEqual([self.question.id], list(index.stats()))
+
+    def test_compact_for_many_voters(self):
+        """A question takes about ten bytes per voter, plus the writes not merged yet."""
+        User.objects.bulk_create(User(username=f'voter{number}') for number in range(5000))
+        users = list(User.objects.filter(username__startswith='voter').order_by('id'))
+        Vote.objects.bulk_create(Vote(user=user, question=self.question, choice=self.choice1) for user in users)
+        index = VoterIndex()
+        index.warm(self.question.id)
+        for user in users[:3000:2]:
+            index.set(self.question.id, user.id, self.choice2.id)
+        index.set(self.question.id, users[1].id, None)
+        voters, size = index.stats()[self.question.id]
+        self.assertEqual(4999, voters)
+        self.assertLess(size, 12 * 5000 + 64 * MERGE_AT)
+        self.assertEqual(self.choice2.id, index.choice_for(self.question.id, users[0].id))
+        self.assertEqual(self.choice2.id, index.choice_for(self.question.id, users[2998].id))
+        self.assertEqual(self.choice1.id, index.choice_for(self.question.id, users[2999].id))
+        self.assertIsNone(index.choice_for(self.question.id, users[1].id))
+
+    def test_catches_up_with_other_workers(self):
+        """A vote written by another worker is seen, a removed one drops the question."""
+        other_worker = VoterIndex()
+        other_worker.warm(self.question.id)
+        vote = Vote.objects.create(user=self.user, question=self.question, choice=self.choice2)
+        self.assertEqual(self.choice2.id, other_worker.choice_for(self.question.id, self.user.id))
+        vote.delete()
+        self.assertIsNone(other_worker.choice_for(self.question.id, self.user.id))
+        self.assertEqual({}, other_worker.stats())
+
+    def test_kept_in_sync_on_write(self):
+        """Saved and deleted votes are reflected in a loaded question."""
+        self.assertIsNone(voter_index.choice_for(self.question.id, self.user.id))
+        vote = Vote.objects.create(user=self.user, question=self.question, choice=self.choice2)
+        self.assertEqual(self.choice2.id, voter_index.choice_for(self.question.id, self.user.id))
+        vote.delete()
+        self.assertIsNone(voter_index.choice_for(self.question.id, self.user.id))
+
+    def test_lru_eviction(self):
+        """The least recently used question is evicted first."""
+        index = VoterIndex(max_bytes=1)
+        other = create_question(question_text="Past question 2.", days=-10)
+        index.warm(self.question.id)
+        index.warm(other.id)
+        self.assertEqual([other.id], list(index.stats()))
+
+    def test_change_vote(self):
+        """Voting twice changes the vote instead of adding a new one."""
+        self.client.login(username='test1', password='test1')
+        url = reverse('polls:polls-vote', args=[self.question.id])
+        self.client.post(url, {'choice': self.choice1.id})
+        self.client.post(url, {'choice': self.choice2.id})
+        self.assertEqual([self.choice2.id], list(self.question.vote_set.values_list('choice_id', flat=True)))
+
+    def test_detail_checks_current_choice(self):
+        """The detail page pre-checks the choice the user voted for."""
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice2)
+        self.client.login(username='test1', password='test1')
+        response = self.client.get(reverse('polls:polls-detail', args=[self.question.id]))
+        self.assertEqual(self.choice2.id, response.context['current_choice_id'])
+        self.assertContains(response, f'value="{self.choice2.id}" checked')
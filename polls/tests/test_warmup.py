@@ -0,0 +1,45 @@
+import datetime
+
+from django.apps import apps
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.urls import reverse
+from ..models import Question
+
+
+def create_question(question_text, days, edays=None):
+    """
+    Create a question with the given `question_text` and published the
+    given number of `days` offset to now (negative for questions published
+    in the past, positive for questions that have yet to be published).
+    """
+    if edays is not None:
+        etime = timezone.now() + datetime.timedelta(days=edays)
+    else:
+        etime = None
+    ptime = timezone.now() + datetime.timedelta(days=days)
+    return Question.objects.create(text=question_text, pub_date=ptime, end_date=etime)
+
+
+class WarmUpTests(TestCase):
+    """Test the worker warm-up."""
+
+    databases = '__all__'
+
+    def test_disabled(self):
+        """Nothing is done when POLLS_WARMUP is off."""
+        with override_settings(POLLS_WARMUP=False):
+            self.assertEqual({}, apps.get_app_config('polls').warm_up())
+
+    def test_warm_up_primes_detail(self):
+        """After the warm-up the detail page of an open poll needs no query."""
+        cache.clear()
+        question = create_question(question_text="Past question 1.", days=-1)
+        question.choice_set.create(text="ans: 1")
+        report = apps.get_app_config('polls').warm_up(force=True)
+        self.assertEqual(['templates', 'urls', 'connections', 'caches'], list(report))
+        self.assertEqual(1, report['caches'][0])
+        self.assertGreater(report['templates'][0], 0)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('polls:polls-detail', args=[question.id]))
@@ -1,13 +1,18 @@
 from django.urls import path
 
 from . import views
+from .querybudget import query_budget
 
 app_name = 'polls'
+# Query budgets count the session and user lookups of a logged in visitor.
+# The home page and ballots cost more with vote shards, per shard they touch.
 urlpatterns = [
-    path('', views.IndexView.as_view(), name='polls-home'),
-    path('<int:pk>/', views.DetailView.as_view(), name='polls-detail'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='polls-results'),
-    path('<int:question_id>/vote', views.vote, name='polls-vote'),
-    path('<int:question_id>/pie-chart/', views.pie_chart, name='polls-pie-chart'),
-    path('signup/', views.signup, name='signup'),
+    path('', query_budget(5, sharded=6, per_shard=1)(views.IndexView.as_view()), name='polls-home'),
+    path('<int:pk>/', query_budget(4)(views.DetailView.as_view()), name='polls-detail'),
+    path('<int:pk>/results/', query_budget(4)(views.ResultsView.as_view()), name='polls-results'),
+    path('<int:question_id>/vote', query_budget(11)(views.vote), name='polls-vote'),
+    path('<int:question_id>/pie-chart/', query_budget(5)(views.pie_chart), name='polls-pie-chart'),
+    path('<int:question_id>/trend/', query_budget(5)(views.trend_chart), name='polls-trend'),
+    path('ballot/', query_budget(12, sharded=3, per_shard=9)(views.ballot), name='polls-ballot'),
+    path('signup/', query_budget(12)(views.signup), name='signup'),
 ]
@@ -1,11 +1,20 @@
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
+from django.conf import settings
 from django.contrib import messages
 from django.views.generic import ListView, DetailView
 from django.utils import timezone
+from django.db import IntegrityError, transaction
 from django.db.models import Q
-from .models import Question, Choice
+from .models import Question, Choice, Vote
+from .lifecycle import published_question_ids
+from .payloads import get_question_payload
+from .rollups import trend
+from .sharding import annotate_leaders, group_by_shard, shard_count, shard_for
+from .signals import vote_changed, votes_changed
+from .tallies import vote_counts
+from .voter_index import voter_index
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import UserCreationForm
@@ -14,7 +23,6 @@ import logging
 from django.contrib.auth.signals import user_logged_in, user_logged_out, user_login_failed
 from django.dispatch import receiver
 
-logging.basicConfig(filename='userlogging.log',level=logging.DEBUG)
 logger = logging.getLogger("polls") 
 
 def pie_chart(request, question_id): # pragma: no cover
@@ -24,9 +32,9 @@ def pie_chart(request, question_id): # pragma: no cover
     data = []
     result = reverse('polls:polls-results', args=(question.id,))
     queryset = question.choice_set.all()
-    for choice in queryset:
+    for choice, votes in vote_counts(question, queryset):
         labels.append(choice.text)
-        data.append(choice.votes)
+        data.append(votes)
 
     return render(request, 'polls/pie_chart.html', {
         'labels': labels,
@@ -36,6 +44,20 @@ def pie_chart(request, question_id): # pragma: no cover
     })
 
 
+def trend_chart(request, question_id):
+    """Show how the votes of each choice moved over time."""
+    question = get_object_or_404(Question, pk=question_id)
+    choices = list(question.choice_set.all())
+    labels, series = trend(question, choices)
+    datasets = [{'label': choice.text, 'data': series[choice.id]} for choice in choices]
+    return render(request, 'polls/trend.html', {
+        'labels': [start.isoformat() for start in labels],
+        'datasets': datasets,
+        'result': reverse('polls:polls-results', args=(question.id,)),
+        'question': question,
+    })
+
+
 class IndexView(ListView):
     """Get the newest 5 polls question and display in ?/polls."""
 
@@ -53,8 +75,21 @@ class IndexView(ListView):
         Return the last five published questions (not including those set to be
         published in the future).
         """
-        query_question = Question.objects.filter(Q(pub_date__lte=timezone.now()) | Q(end_date__isnull=True, pub_date__lte=timezone.now())).order_by('-pub_date')
-        return query_question[:5]
+        # which polls are published is resolved once per opening, not per request
+        query_question = Question.objects.filter(id__in=published_question_ids()).order_by('-pub_date')
+        if shard_count():
+            # votes are in other databases, count them shard by shard
+            return annotate_leaders(query_question[:5])
+        # vote total and leading choice come from subqueries of the same query
+        return query_question.with_leader()[:5]
+
+
+def detail_context(user, question, choices):
+    """Return the context of detail.html, shared by DetailView and vote()."""
+    data = {'question': question, 'choices': choices}
+    if user.is_authenticated:
+        data['current_choice_id'] = voter_index.choice_for(question.id, user.id)
+    return data
 
 
 class DetailView(DetailView):
@@ -70,6 +105,20 @@ class DetailView(DetailView):
         """
         return Question.objects.filter(pub_date__lte=timezone.now())
 
+    def get_object(self, queryset=None):
+        """Return the published question from the cached detail payload."""
+        payload = get_question_payload(self.kwargs['pk'])
+        if payload is None or payload[0].pub_date > timezone.now():
+            raise Http404("No question found matching the query")
+        question, self.choices = payload
+        return question
+
+    def get_context_data(self, *args, **kwargs):
+        """Get context data with the choices and the one the user already voted for."""
+        data = super(DetailView, self).get_context_data(*args, **kwargs)
+        data.update(detail_context(self.request.user, self.object, self.choices))
+        return data
+
 
 class ResultsView(DetailView):
     """Display all vote result of the selected question"""
@@ -82,44 +131,166 @@ class ResultsView(DetailView):
         data = super(ResultsView, self).get_context_data(*args, **kwargs)
         data['title'] = "List"
         data['back_home'] = True
+        data['choice_votes'] = vote_counts(self.object, self.choices)
         return data
 
 @login_required(login_url='/login/') 
 def vote(request, question_id):
     """Save the voting result to question object that user selected"""
-    # load question object
-    question = get_object_or_404(Question, pk=question_id)
+    # load question object and its choices
+    payload = get_question_payload(question_id)
+    if payload is None:
+        raise Http404("No question found matching the query")
+    question, choices = payload
     user = request.user
     try:
         # check selected choice
-        selected_choice = question.choice_set.get(pk=int(request.POST['choice']))
-    except (KeyError, Choice.DoesNotExist):
+        choice_id = int(request.POST['choice'])
+        selected_choice = next(choice for choice in choices if choice.id == choice_id)
+    except (KeyError, ValueError, StopIteration):
         # User not select any choice
         # display warning messages
         messages.warning(request, "You didn't select a choice.", fail_silently=True)
         # Redisplay the question voting form.
-        return render(request, 'polls/detail.html', {
-            'question': question,
-        })
+        return render(request, 'polls/detail.html', detail_context(user, question, choices))
     else:
         # save vote
         if not question.can_vote():
             messages.error(request, "You voted failed! Polls ended", fail_silently=True)
             return HttpResponseRedirect(reverse('polls:polls-results', args=(question.id,)))
-        if question.vote_set.filter(user=user).exists():
-            vote = question.vote_set.get(user=user)
-            vote.choice = selected_choice
-            vote.save()
-            messages.success(request, "You have successfully changed your vote.",fail_silently=True )  
+        # the voter index tells insert from update without reading the Vote table,
+        # the update only applies if the vote is still the one the index knows
+        previous_choice_id = voter_index.choice_for(question.id, user.id)
+        if previous_choice_id is not None and question.vote_set.filter(user=user, choice_id=previous_choice_id).update(
+                choice=selected_choice, voted_at=timezone.now()):
+            vote_changed.send(sender=Vote, question_id=question.id, user_id=user.id,
+                              old_choice_id=previous_choice_id, new_choice_id=selected_choice.id)
+            messages.success(request, "You have successfully changed your vote.", fail_silently=True)
         else:
-            selected_choice.vote_set.create(user=request.user, question=question)
-            selected_choice.save()
-            messages.success(request, "You voted successfully.",fail_silently=True )
+            try:
+                with transaction.atomic(using=shard_for(question.id)):
+                    Vote.objects.create(user=user, question=question, choice=selected_choice)
+            except IntegrityError:
+                # the index was out of date, the user had already voted or changed their vote elsewhere
+                previous_choice_id = question.vote_set.filter(user=user).values_list('choice_id', flat=True).first()
+                question.vote_set.filter(user=user).update(choice=selected_choice, voted_at=timezone.now())
+                vote_changed.send(sender=Vote, question_id=question.id, user_id=user.id,
+                                  old_choice_id=previous_choice_id, new_choice_id=selected_choice.id)
+                messages.success(request, "You have successfully changed your vote.", fail_silently=True)
+            else:
+                messages.success(request, "You voted successfully.", fail_silently=True)
         # Always return an HttpResponseRedirect after successfully dealing
         # with POST data. This prevents data from being posted twice if a
         # user hits the Back button.
         return HttpResponseRedirect(reverse('polls:polls-results', args=(question.id,)))
 
+
+def ballot_questions(question_ids=None):
+    """
+    Return ``[(question, [choices])]`` of open questions, in one query.
+
+    Every open question when ``question_ids`` is empty, at most
+    POLLS_BALLOT_MAX_QUESTIONS of them. Questions without choices are left out.
+    """
+    now = timezone.now()
+    choices = (Choice.objects.select_related('question')
+               .filter(question__pub_date__lte=now, question__archived_at__isnull=True)
+               .filter(Q(question__end_date__isnull=True) | Q(question__end_date__gte=now)))
+    if question_ids:
+        choices = choices.filter(question_id__in=question_ids)
+    else:
+        limit = getattr(settings, 'POLLS_BALLOT_MAX_QUESTIONS', 50)
+        latest = Question.objects.filter(pub_date__lte=now, archived_at__isnull=True)
+        latest = latest.filter(Q(end_date__isnull=True) | Q(end_date__gte=now)).order_by('-pub_date')
+        choices = choices.filter(question__in=latest.values('id')[:limit])
+    questions = {}
+    for choice in choices.order_by('-question__pub_date', 'question_id', 'id'):
+        question, question_choices = questions.setdefault(choice.question_id, (choice.question, []))
+        choice.question = question
+        question_choices.append(choice)
+    return list(questions.values())
+
+
+def save_ballot(user, selected_choices):
+    """
+    Write the user's vote for every selected choice in one transaction per
+    vote shard, a single one when votes are not sharded.
+
+    Existing votes are read in one query, then changed with one bulk update
+    and new ones inserted with one bulk insert. Return the ``changes`` sent
+    with :data:`polls.signals.votes_changed`.
+    """
+    now = timezone.now()
+    changes = []
+    for alias, shard_choices in group_by_shard(selected_choices, lambda choice: choice.question_id).items():
+        question_ids = [choice.question_id for choice in shard_choices]
+        with transaction.atomic(using=alias):
+            existing = {vote.question_id: vote for vote in
+                        Vote.objects.using(alias).select_for_update().filter(user=user, question_id__in=question_ids)}
+            shard_changes, updated, created = [], [], []
+            for choice in shard_choices:
+                vote = existing.get(choice.question_id)
+                if vote is None:
+                    created.append(Vote(user=user, question_id=choice.question_id, choice=choice, voted_at=now))
+                    shard_changes.append((choice.question_id, user.id, None, choice.id))
+                elif vote.choice_id != choice.id:
+                    shard_changes.append((choice.question_id, user.id, vote.choice_id, choice.id))
+                    vote.choice_id, vote.voted_at = choice.id, now
+                    updated.append(vote)
+            Vote.objects.using(alias).bulk_update(updated, ['choice', 'voted_at'])
+            Vote.objects.using(alias).bulk_create(created)
+            votes_changed.send(sender=Vote, changes=shard_changes)
+        changes += shard_changes
+    return changes
+
+
+def parse_id(value):
+    """Return ``value`` as a primary key, None when it is not a number a 64-bit column can hold."""
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if 0 < value < 2 ** 63 else None
+
+
+@login_required(login_url='/login/')
+def ballot(request):
+    """Vote on many questions at once and confirm them all on one page."""
+    if request.method != 'POST':
+        question_ids = [parse_id(value) for value in request.GET.getlist('question')]
+        questions = ballot_questions([question_id for question_id in question_ids if question_id is not None])
+        return render(request, 'polls/ballot.html', {'questions': questions})
+    selected = {}
+    for key, value in request.POST.items():
+        if key.startswith('question-'):
+            question_id, choice_id = parse_id(key[len('question-'):]), parse_id(value)
+            if question_id is not None and choice_id is not None:
+                selected[question_id] = choice_id
+    questions = ballot_questions(list(selected))
+    choices = {choice.id: choice for _, question_choices in questions for choice in question_choices}
+    valid = []
+    for question_id, choice_id in selected.items():
+        choice = choices.get(choice_id)
+        if choice is not None and choice.question_id == question_id:
+            valid.append(choice)
+    if not selected or len(valid) != len(selected):
+        messages.warning(request, "Select a choice of an open poll for every question.", fail_silently=True)
+        return render(request, 'polls/ballot.html', {
+            'questions': questions,
+            'selected_choice_ids': list(selected.values()),
+        })
+    try:
+        changes = save_ballot(request.user, valid)
+    except IntegrityError:
+        # a vote of the same user was cast concurrently, the second try sees it
+        changes = save_ballot(request.user, valid)
+    changed = {question_id for question_id, _, old, _ in changes if old is not None}
+    messages.success(request, f"You voted on {len(valid)} polls.", fail_silently=True)
+    return render(request, 'polls/ballot_done.html', {
+        'votes': [(choice.question, choice, choice.question_id in changed) for choice in valid],
+    })
+
+
 def signup(request):
     """Register a new user."""
     if request.method == 'POST':
@@ -0,0 +1,273 @@
+"""In-memory index of who voted for what, per question."""
+import datetime
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Vote
+
+# recent writes are kept in a dict and merged into the arrays past this size
+MERGE_AT = 1024
+# votes committed this long before a catch-up started are read again
+SYNC_SLACK = datetime.timedelta(seconds=60)
+
+
+def version_keys(question_id):
+    """Return the cache keys counting the vote writes and removals of a question."""
+    return f'polls:voters:{question_id}', f'polls:voters:{question_id}:removed'
+
+
+def bump(key):
+    """Add one to a shared counter and return its new value."""
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # evicted between add() and incr()
+        cache.add(key, 1, None)
+        return None
+
+
+class QuestionVoters:
+    """
+    Voters of one question in two parallel arrays.
+
+    ``users`` holds the sorted user ids (8 bytes each) and ``choices`` the
+    position of their choice in ``choice_ids`` (2 bytes each). Writes go to
+    the small ``recent`` dict, None marking a removed vote, and are merged
+    into the arrays once it grows past MERGE_AT.
+    """
+
+    def __init__(self, rows, version, synced_at):
+        self.users = array('q')
+        self.choices = array('H')
+        self.choice_ids = []
+        self.recent = {}
+        self.version = version
+        self.synced_at = synced_at
+        positions = {}
+        for user_id, choice_id in rows:
+            self.users.append(user_id)
+            self.choices.append(self._position(positions, choice_id))
+
+    def _position(self, positions, choice_id):
+        position = positions.get(choice_id)
+        if position is None:
+            position = positions[choice_id] = len(self.choice_ids)
+            self.choice_ids.append(choice_id)
+        return position
+
+    def get(self, user_id):
+        if user_id in self.recent:
+            return self.recent[user_id]
+        index = bisect_left(self.users, user_id)
+        if index < len(self.users) and self.users[index] == user_id:
+            return self.choice_ids[self.choices[index]]
+        return None
+
+    def set(self, user_id, choice_id):
+        self.recent[user_id] = choice_id
+        if len(self.recent) > MERGE_AT:
+            self.merge()
+
+    def merge(self):
+        """Fold the recent writes into new arrays, in one pass."""
+        positions = {choice_id: position for position, choice_id in enumerate(self.choice_ids)}
+        users, choices = array('q'), array('H')
+        recent = sorted(self.recent.items())
+        index = 0
+        for position, user_id in enumerate(self.users):
+            while index < len(recent) and recent[index][0] < user_id:
+                self._append(users, choices, positions, *recent[index])
+                index += 1
+            if index < len(recent) and recent[index][0] == user_id:
+                self._append(users, choices, positions, *recent[index])
+                index += 1
+            else:
+                users.append(user_id)
+                choices.append(self.choices[position])
+        for user_id, choice_id in recent[index:]:
+            self._append(users, choices, positions, user_id, choice_id)
+        self.users, self.choices, self.recent = users, choices, {}
+
+    def _append(self, users, choices, positions, user_id, choice_id):
+        if choice_id is not None:
+            users.append(user_id)
+            choices.append(self._position(positions, choice_id))
+
+    def _stored(self, user_id):
+        index = bisect_left(self.users, user_id)
+        return index < len(self.users) and self.users[index] == user_id
+
+    def __len__(self):
+        count = len(self.users)
+        for user_id, choice_id in self.recent.items():
+            stored = self._stored(user_id)
+            if stored and choice_id is None:
+                count -= 1
+            elif not stored and choice_id is not None:
+                count += 1
+        return count
+
+    def memory_usage(self):
+        """Return the size in bytes of the arrays and of the recent writes."""
+        size = sys.getsizeof(self.users) + sys.getsizeof(self.choices) + sys.getsizeof(self.choice_ids)
+        size += sys.getsizeof(self.recent) + sum(sys.getsizeof(user_id) for user_id in self.recent)
+        return size
+
+
+class VoterIndex:
+    """
+    Map ``user_id -> choice_id`` for the most recently used questions.
+
+    A cold question is answered with a single-row query. It is loaded from
+    :model:`polls.Vote` by :meth:`warm` (worker warm-up, poll opening) or
+    lazily once ``load_after`` lookups have missed it, then kept in sync by
+    :meth:`set` / :meth:`discard`. When the loaded questions take more than
+    ``max_bytes`` the least recently used ones are dropped.
+
+    Workers share two counters per question through the cache: a loaded
+    question that another worker wrote to catches up with the votes cast
+    since its last sync, and one another worker removed votes from is
+    dropped. This needs a cache shared by the workers, see CACHES.
+
+    Property
+    --------
+    max_bytes: int
+        Memory the loaded questions may take, about 10 bytes per voter.
+    load_after: int
+        Cold lookups of a question before it is loaded.
+    """
+
+    def __init__(self, max_bytes=None, load_after=None):
+        if max_bytes is None:
+            max_bytes = getattr(settings, 'POLLS_VOTER_INDEX_BYTES', 32 * 1024 * 1024)
+        if load_after is None:
+            load_after = getattr(settings, 'POLLS_VOTER_INDEX_LOAD_AFTER', 20)
+        self.max_bytes = max_bytes
+        self.load_after = load_after
+        self._questions = OrderedDict()
+        self._misses = {}
+        self._lock = threading.RLock()
+
+    def _versions(self, question_id):
+        values = cache.get_many(version_keys(question_id))
+        return tuple(values.get(key, 0) for key in version_keys(question_id))
+
+    def _load(self, question_id):
+        """Load the voters of a question and return them."""
+        version = self._versions(question_id)
+        synced_at = timezone.now()
+        rows = (Vote.objects.filter(question_id=question_id).order_by('user_id')
+                .values_list('user_id', 'choice_id'))
+        voters = QuestionVoters(rows.iterator(chunk_size=10000), version, synced_at)
+        with self._lock:
+            # another thread may have loaded it meanwhile, keep the first one
+            voters = self._questions.setdefault(question_id, voters)
+            self._questions.move_to_end(question_id)
+            self._misses.pop(question_id, None)
+            self._evict()
+        return voters
+
+    def _evict(self):
+        total = sum(voters.memory_usage() for voters in self._questions.values())
+        while len(self._questions) > 1 and total > self.max_bytes:
+            _, voters = self._questions.popitem(last=False)
+            total -= voters.memory_usage()
+
+    def _loaded(self, question_id):
+        """Return the up to date voters of a loaded question, or None."""
+        with self._lock:
+            voters = self._questions.get(question_id)
+            if voters is None:
+                return None
+            self._questions.move_to_end(question_id)
+        version = self._versions(question_id)
+        if version == voters.version:
+            return voters
+        if version[1] != voters.version[1]:
+            # votes were removed elsewhere, they can not be caught up with
+            self.discard(question_id, notify=False)
+            return None
+        synced_at = timezone.now()
+        rows = (Vote.objects.filter(question_id=question_id, voted_at__gte=voters.synced_at - SYNC_SLACK)
+                .values_list('user_id', 'choice_id'))
+        with self._lock:
+            for user_id, choice_id in rows:
+                voters.set(user_id, choice_id)
+            voters.version, voters.synced_at = version, synced_at
+        return voters
+
+    def warm(self, question_id):
+        """Load a question ahead of its lookups."""
+        if self._loaded(question_id) is None:
+            self._load(question_id)
+
+    def choice_for(self, question_id, user_id):
+        """Return the choice id the user voted for, or None."""
+        voters = self._loaded(question_id)
+        if voters is None:
+            with self._lock:
+                misses = self._misses[question_id] = self._misses.get(question_id, 0) + 1
+            if misses < self.load_after:
+                return (Vote.objects.filter(question_id=question_id, user_id=user_id)
+                        .values_list('choice_id', flat=True).first())
+            voters = self._load(question_id)
+        with self._lock:
+            return voters.get(user_id)
+
+    def _write(self, question_id, user_id, choice_id, counter):
+        version = bump(version_keys(question_id)[counter])
+        with self._lock:
+            voters = self._questions.get(question_id)
+            if voters is None:
+                return
+            voters.set(user_id, choice_id)
+            if version is not None and version == voters.version[counter] + 1:
+                # nobody else wrote in between, stay in sync without a catch-up
+                voters.version = voters.version[:counter] + (version,) + voters.version[counter + 1:]
+
+    def set(self, question_id, user_id, choice_id):
+        """Record a new or changed vote. Cold questions are left cold."""
+        self._write(question_id, user_id, choice_id, 0)
+
+    def discard(self, question_id, user_id=None, notify=True):
+        """
+        Forget one vote, or the whole question when user_id is None. Other
+        workers drop the question too unless ``notify`` is False.
+        """
+        if user_id is not None:
+            self._write(question_id, user_id, None, 1)
+            return
+        if notify:
+            bump(version_keys(question_id)[1])
+        with self._lock:
+            self._questions.pop(question_id, None)
+            self._misses.pop(question_id, None)
+
+    def clear(self):
+        """Drop every loaded question."""
+        with self._lock:
+            self._questions.clear()
+            self._misses.clear()
+
+    def memory_usage(self, question_id):
+        """Return the approximate size in bytes of a loaded question, 0 if it is not loaded."""
+        with self._lock:
+            voters = self._questions.get(question_id)
+            return 0 if voters is None else voters.memory_usage()
+
+    def stats(self):
+        """Return ``{question_id: (voters, bytes)}`` for loaded questions."""
+        with self._lock:
+            return {question_id: (len(voters), voters.memory_usage())
+                    for question_id, voters in self._questions.items()}
+
+
+voter_index = VoterIndex()
@@ -0,0 +1,108 @@
+"""Do the slow first-request work of a worker before it accepts traffic."""
+import logging
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.loader import get_template
+from django.urls import NoReverseMatch, get_resolver, reverse
+from django.utils import timezone
+
+logger = logging.getLogger("polls")
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply POLLS_SQLITE_PRAGMAS to every new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'POLLS_SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def load_templates():
+    """Compile every polls template, kept by the cached template loader."""
+    template_dir = os.path.join(apps.get_app_config('polls').path, 'templates')
+    names = []
+    for root, _, files in os.walk(template_dir):
+        for filename in files:
+            if filename.endswith('.html'):
+                names.append(os.path.relpath(os.path.join(root, filename), template_dir).replace(os.sep, '/'))
+    for name in names:
+        get_template(name)
+    return len(names)
+
+
+def resolve_urls():
+    """Build the URL resolvers and reverse every polls route once."""
+    get_resolver().reverse_dict  # populates the root resolver
+    routes = 0
+    for pattern in get_resolver('polls.urls').url_patterns:
+        args = [1] * len(pattern.pattern.converters)
+        try:
+            reverse(f'polls:{pattern.name}', args=args)
+        except NoReverseMatch:
+            continue
+        routes += 1
+    return routes
+
+
+def open_connections():
+    """Open and configure a connection to every database."""
+    for connection in connections.all():
+        connection.ensure_connection()
+    return len(connections.all())
+
+
+def prime_caches():
+    """Load the detail payload and voter index of the newest open polls."""
+    from .models import Question
+    from .payloads import get_question_payload
+    from .tallies import get_tally_store
+    from .voter_index import voter_index
+
+    get_tally_store()
+    now = timezone.now()
+    question_ids = list(Question.objects.filter(pub_date__lte=now, archived_at__isnull=True)
+                        .exclude(end_date__lt=now).order_by('-pub_date')
+                        .values_list('id', flat=True)[:getattr(settings, 'POLLS_WARMUP_QUESTIONS', 20)])
+    for question_id in question_ids:
+        get_question_payload(question_id)
+        voter_index.warm(question_id)
+    return len(question_ids)
+
+
+STEPS = [
+    ('templates', load_templates),
+    ('urls', resolve_urls),
+    ('connections', open_connections),
+    ('caches', prime_caches),
+]
+
+
+def warm_up(force=False):
+    """
+    Run every warm-up step and return ``{step: (count, seconds)}``.
+
+    Does nothing unless POLLS_WARMUP is set or ``force`` is given. A failing
+    step is logged and skipped, a worker must still start without it.
+    """
+    if not force and not getattr(settings, 'POLLS_WARMUP', False):
+        return {}
+    report = {}
+    for name, step in STEPS:
+        start = time.perf_counter()
+        try:
+            count = step()
+        except Exception:
+            logger.exception("Warm-up step %s failed", name)
+            count = None
+        report[name] = (count, time.perf_counter() - start)
+    logger.info("Warm-up done: %s", ", ".join(f"{name} {count} in {seconds * 1000:.1f}ms"
+                                              for name, (count, seconds) in report.items()))
+    return report